@@ -1,211 +1,126 @@
+import base64
+import hashlib
+import json
+
 from flask import Blueprint
+from flask import Response
 from flask import jsonify
 from flask import redirect
 from flask import render_template
 from flask import request
 from flask import url_for
-from sqlalchemy import text
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import sessionmaker
 
-from libinv.base import engine
-from libinv.models import Repository
-from libinv.scio_models import VulnerablePath
+from libinv.api.actionable_view import actionable_cache
+from libinv.api.actionable_view import page_of_actionables
+from libinv.api.actionable_view import page_of_packages
+from libinv.api.actionable_view import page_of_paths
+from libinv.api.actionable_view import path_filters
+from libinv.api.actionable_view import scan_version
+from libinv.base import Session
 
 actionable = Blueprint("actionable", __name__, template_folder="templates")
 
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+COMMONS = {"false": False, "true": True, "any": None}
 
-def fetch_repository(repository_id):
-    try:
-        Session = sessionmaker(bind=engine)
-        conn = Session()
-        result = conn.query(Repository).filter_by(id=repository_id).first()
-        return result
-    except SQLAlchemyError as e:
-        conn.rollback()
-        print(str(e))
-    finally:
-        conn.close()
-
-
-def fetch_vulnerable_packages(repository_id, environment):
-    try:
-        Session = sessionmaker(bind=engine)
-        conn = Session()
-        vulnerable_package_ids = conn.execute(
-            text(
-                "SELECT DISTINCT vulnerable_package_id FROM public.scanpipe_vulnerablepaths WHERE "
-                + "repository_id = :repository_id AND environment = :environment "
-                + "AND has_commons_in_path = false"
-            ),
-            {"repository_id": repository_id, "environment": environment},
-        ).fetchall()
-        return [package_id[0] for package_id in vulnerable_package_ids]
-    except SQLAlchemyError as e:
-        print(e)
-        conn.rollback()
-    finally:
-        conn.close()
-
-
-def resolve_packages(package_ids):
-    try:
-        Session = sessionmaker(bind=engine)
-        conn = Session()
-        packages = conn.execute(
-            text(
-                "SELECT id,CONCAT('pkg:',type,'/',namespace,'/',name,'@', version,'?',qualifiers)"
-                + '  as "purl" FROM public.scanpipe_discoveredpackage WHERE id IN :ids'
-            ),
-            {"ids": tuple(package_ids)},
-        ).fetchall()
-        return packages
-    except SQLAlchemyError as e:
-        conn.rollback()
-        print(str(e))
-        return []
-    finally:
-        conn.close()
-
-
-def fetch_vulnerable_paths(repository_id, environment, allow_commons=False, selected_package=None):
-    try:
-        Session = sessionmaker(bind=engine)
-        conn = Session()
-        if selected_package:
-            selected_package = int(selected_package)
-            vulnerable_paths = (
-                conn.query(VulnerablePath)
-                .filter_by(
-                    repository_id=repository_id,
-                    has_commons_in_path=allow_commons,
-                    environment=environment,
-                    vulnerable_package_id=selected_package,
-                )
-                .filter(VulnerablePath.action_item.isnot(None))
-                .all()
-            )
-        else:
-            vulnerable_paths = (
-                conn.query(VulnerablePath)
-                .filter_by(
-                    repository_id=repository_id,
-                    has_commons_in_path=allow_commons,
-                    environment=environment,
-                )
-                .all()
-            )
-        return vulnerable_paths
-    except SQLAlchemyError as e:
-        conn.rollback()
-        print(str(e))
-    finally:
-        conn.close()
-
-
-def resolve_paths(paths):
-    # resolve required purls using scancode DB
-    package_ids_to_resolve = set()
-    for path in paths:
-        path = path.path[1:]
-        for element in path:
-            if element.isdigit():
-                package_ids_to_resolve.add(int(element))
-
-    resolved_purls = resolve_packages(package_ids_to_resolve)
-
-    # replace every package id with the resolved purl
-    resolved_paths = []
-    for path in paths:
-        path = path.path
-        for i in range(1, len(path)):
-            if not path[i].isdigit():
-                continue
-            for resolved_purl in resolved_purls:
-                if int(path[i]) == resolved_purl[0]:
-                    path[i] = resolved_purl[1]
-                    break
-        resolved_paths.append(path)
-
-    return resolved_paths
-
-
-def extract_actionables(vulnerable_paths):
+
+class BadRequest(ValueError):
+    pass
+
+
+def encode_cursor(key) -> str:
     """
-    Given a vulnerable path, we extract the actionable item from the path
-    action_item field has the index of the action item in the path
+    >>> encode_cursor("pkg:npm/left-pad@1.0.0")
+    'InBrZzpucG0vbGVmdC1wYWRAMS4wLjAi'
+    >>> decode_cursor(encode_cursor(42))
+    42
     """
-    resolved_actionables = set()
-    for path in vulnerable_paths:
-        actionable = path.path[int(path.action_item)]
-        resolved_actionables.add(actionable)
-    return resolved_actionables
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
 
 
-def fetch_actionable_packages(repository_id, environment):
+def decode_cursor(cursor):
+    if not cursor:
+        return None
     try:
-        Session = sessionmaker(bind=engine)
-        conn = Session()
-        actionable_packages = conn.execute(
-            text(
-                """
-                    with action_items as (
-                        select 
-                            replace((path -> action_item::integer)::varchar, '"', '') 
-                            "action_item_id"
-                        from
-                            scanpipe_vulnerablepaths sv 	
-                        where 
-                            repository_id = :repository_id 
-                            and environment = :environment
-                            and has_commons_in_path = false
-                        group by action_item_id
-                    ), 
-                    integer_action_items as (
-                        select 
-                            concat('pkg:', sd.type, '/', sd.namespace, '/', sd.name, '@', sd.version, '?', sd.qualifiers) "action_item_purl"
-                        from 
-                            action_items
-                        left join 
-                            scanpipe_discoveredpackage sd on sd.id = action_item_id::integer
-                        where  
-                            action_item_id::varchar ~ '^[0-9]+$'
-                    ), 
-                    non_integer_action_items as (
-                        select 
-                            action_item_id "action_item_purl"
-                        from 
-                            action_items 
-                        where 
-                            action_item_id::varchar !~ '^[0-9]+$'
-                    )
-                    select 
-                        * 
-                    from 
-                        integer_action_items
-                    union select * from non_integer_action_items
-                """
-            ),
-            {"repository_id": repository_id, "environment": environment},
-        ).fetchall()
-        return [package[0] for package in actionable_packages]
-    except SQLAlchemyError as e:
-        print(e)
-        conn.rollback()
-    finally:
-        conn.close()
-    return None
-
-
-def fetch_available_envs(repository_id):
-    Session = sessionmaker(bind=engine)
-    conn = Session()
-    return (
-        conn.query(VulnerablePath)
-        .filter_by(repository_id=repository_id)
-        .distinct(VulnerablePath.environment)
-        .all()
-    )
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise BadRequest("cursor is invalid")
+
+
+def query_filters() -> dict:
+    """
+    Return filters of vulnerable paths given in the query string
+    """
+    args = request.args
+    if not args.get("repository_id", "").isdigit():
+        raise BadRequest("repository_id parameter missing")
+    if args.get("commons", "false") not in COMMONS:
+        raise BadRequest("commons parameter must be one of false, true or any")
+    package = args.get("package")
+    if package is not None and not package.isdigit():
+        raise BadRequest("package parameter must be a package id")
+    return {
+        "repository_id": int(args["repository_id"]),
+        "environment": args.get("env"),
+        "package_id": None if package is None else int(package),
+        "commons": COMMONS[args.get("commons", "false")],
+    }
+
+
+def paginated(fetch, key):
+    """
+    Respond with a page of results of ``fetch(session, filters, after, limit)`` and a cursor to the
+    next page, ``key`` of the last result being where the next page starts.
+
+    The ETag is derived from the repository's scan version, so a client that already has a page is
+    told it is unchanged without the page being queried again.
+    """
+    try:
+        filters = query_filters()
+        after = decode_cursor(request.args.get("cursor"))
+        limit = min(max(int(request.args.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except (BadRequest, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    with Session() as session:
+        version = scan_version(session, filters["repository_id"], filters["environment"])
+        etag = hashlib.sha1(f"{version}{request.full_path}".encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        results = fetch(session, path_filters(**filters), after, limit + 1)
+
+    next_cursor = encode_cursor(key(results[limit - 1])) if len(results) > limit else None
+    response = jsonify({"results": results[:limit], "next": next_cursor})
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+@actionable.route("/api/packages", methods=["GET"])
+def vulnerable_packages_api():
+    def fetch(session, filters, after, limit):
+        return [package._asdict() for package in page_of_packages(session, filters, after, limit)]
+
+    return paginated(fetch, key=lambda package: package["id"])
+
+
+@actionable.route("/api/paths", methods=["GET"])
+def vulnerable_paths_api():
+    return paginated(page_of_paths, key=lambda path: path["id"])
+
+
+@actionable.route("/api/actionables", methods=["GET"])
+def actionables_api():
+    def fetch(session, filters, after, limit):
+        return [
+            {"action_item": action_item, "purl": purl}
+            for action_item, purl in page_of_actionables(session, filters, after, limit)
+        ]
+
+    return paginated(fetch, key=lambda actionable: actionable["action_item"])
 
 
 @actionable.route("/", methods=["GET"])
@@ -216,24 +131,23 @@ def plain_actionables():
     if not repository_id or not environment:
         return jsonify({"error": "repository_id or env parameter missing"}), 500
 
-    repository = fetch_repository(repository_id)
-    vulnerable_packages = resolve_packages(fetch_vulnerable_packages(repository_id, environment))
+    with Session() as session:
+        view = actionable_cache.get(session, repository_id, environment)
 
-    if len(vulnerable_packages) == 0:
+    if len(view.vulnerable_packages) == 0:
         return render_template(
             "actionables_dashboard.html",
-            repository=repository,
-            vulnerable_packages=vulnerable_packages,
+            repository=view.repository,
+            vulnerable_packages=view.vulnerable_packages,
             selected_env=environment,
             no_actionables=True,
         )
 
-    actionables = fetch_actionable_packages(repository_id, environment)
     return render_template(
         "actionables_dashboard.html",
-        actionables=actionables,
-        vulnerable_packages=vulnerable_packages,
-        repository=repository,
+        actionables=view.actionables,
+        vulnerable_packages=view.vulnerable_packages,
+        repository=view.repository,
         selected_env=environment,
     )
 
@@ -251,18 +165,15 @@ def how_to_fix():
                     "actionable.plain_actionables", repository_id=repository_id, env=environment
                 )
             )
-        available_envs = fetch_available_envs(repository_id)
         selected_package = int(selected_package)
-        repository = fetch_repository(repository_id)
-        all_vulnerable_packages = resolve_packages(
-            fetch_vulnerable_packages(repository_id, environment=environment)
-        )
-        unresolved_non_commons_paths = fetch_vulnerable_paths(
-            repository_id, selected_package=selected_package, environment=environment
-        )
-        non_commons_paths = resolve_paths(unresolved_non_commons_paths)
-        resolved_actionables = extract_actionables(unresolved_non_commons_paths)
-        resolved_selected_package = resolve_packages([selected_package])[0]
+        with Session() as session:
+            view = actionable_cache.get(session, repository_id, environment)
+        available_envs = view.environments
+        repository = view.repository
+        all_vulnerable_packages = view.vulnerable_packages
+        non_commons_paths = view.resolved_paths(selected_package)
+        resolved_actionables = view.package_actionables(selected_package)
+        resolved_selected_package = view.package(selected_package)
 
         if show_paths == "true":
             return render_template(
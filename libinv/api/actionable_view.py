@@ -0,0 +1,298 @@
+import threading
+import time
+from collections import OrderedDict
+from collections import defaultdict
+from collections import namedtuple
+
+from attrs import define
+from attrs import field
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy import cast
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import text
+
+from libinv.env import ACTIONABLE_CACHE_SIZE
+from libinv.env import ACTIONABLE_CACHE_TTL
+from libinv.models import Repository
+from libinv.models import Wasp
+from libinv.scio_models import VulnerablePath
+
+ResolvedPackage = namedtuple("ResolvedPackage", ["id", "purl"])
+VulnerablePathRow = namedtuple(
+    "VulnerablePathRow", ["vulnerable_package_id", "path", "action_item"]
+)
+
+PURLS_QUERY = text(
+    "SELECT id, CONCAT('pkg:',type,'/',namespace,'/',name,'@', version,'?',qualifiers) AS purl"
+    " FROM public.scanpipe_discoveredpackage WHERE id = ANY(:ids)"
+)
+
+
+def package_ids(path):
+    """
+    Return ids of discovered packages in a path, the first element being the project
+
+    >>> package_ids(["project", "12", "pkg:npm/left-pad@1.0.0", "7"])
+    [12, 7]
+    """
+    return [int(element) for element in path[1:] if element.isdigit()]
+
+
+def resolve_path(path, purls: dict) -> list:
+    """
+    Return a copy of a path with every package id after the project replaced by its purl
+
+    >>> resolve_path(["7", "12", "pkg:npm/left-pad@1.0.0", "99"], {7: "pkg:a", 12: "pkg:b"})
+    ['7', 'pkg:b', 'pkg:npm/left-pad@1.0.0', '99']
+    """
+    return path[:1] + [
+        purls.get(int(element), element) if element.isdigit() else element for element in path[1:]
+    ]
+
+
+@define
+class ActionableView:
+    """
+    Everything the actionables dashboard shows for a repository in an environment, loaded at once.
+    Only paths without commons in them are kept, as those are the only ones shown.
+    """
+
+    repository: Repository
+    environment: str
+    environments: list
+    paths: list  # of VulnerablePathRow
+    purls: dict  # discovered package id: purl, for every package in paths
+    vulnerable_packages: list = field(init=False)  # of ResolvedPackage
+    actionables: set = field(init=False)
+    package_paths: dict = field(init=False)  # vulnerable package id: paths to it with an action
+    resolved: dict = field(init=False, factory=dict)  # vulnerable package id: resolved paths
+
+    def __attrs_post_init__(self):
+        self.package_paths = defaultdict(list)
+        for path in self.paths:
+            if path.action_item is not None:
+                self.package_paths[path.vulnerable_package_id].append(path)
+
+        vulnerable_package_ids = {path.vulnerable_package_id for path in self.paths}
+        self.vulnerable_packages = [
+            ResolvedPackage(package_id, self.purls[package_id])
+            for package_id in sorted(vulnerable_package_ids)
+            if package_id in self.purls
+        ]
+        self.actionables = self.extract_actionables(self.paths)
+
+    @classmethod
+    def load(cls, session, repository_id: int, environment: str):
+        repository = session.get(Repository, repository_id)
+        if repository is not None:
+            session.expunge(repository)  # outlives the session in the cache
+        environments = session.scalars(
+            select(VulnerablePath.environment)
+            .where(VulnerablePath.repository_id == repository_id)
+            .distinct()
+        ).all()
+        paths = [
+            VulnerablePathRow(*row)
+            for row in session.execute(
+                select(
+                    VulnerablePath.vulnerable_package_id,
+                    VulnerablePath.path,
+                    VulnerablePath.action_item,
+                ).where(*path_filters(repository_id, environment, commons=False))
+            )
+        ]
+
+        ids = {path.vulnerable_package_id for path in paths}
+        for path in paths:
+            ids.update(package_ids(path.path))
+        return cls(repository, environment, environments, paths, resolve_purls(session, ids))
+
+    def resolve(self, element: str) -> str:
+        if element.isdigit():
+            return self.purls.get(int(element), element)
+        return element
+
+    def extract_actionables(self, paths) -> set:
+        """
+        Return resolved action items of paths, ``action_item`` being the index of one in its path
+        """
+        return {
+            self.resolve(path.path[int(path.action_item)])
+            for path in paths
+            if path.action_item is not None
+        }
+
+    def resolved_paths(self, package_id: int) -> list:
+        """
+        Return paths to a vulnerable package with purls in place of package ids, resolved once
+        """
+        if package_id not in self.resolved:
+            self.resolved[package_id] = [
+                resolve_path(path.path, self.purls)
+                for path in self.package_paths.get(package_id, [])
+            ]
+        return self.resolved[package_id]
+
+    def package_actionables(self, package_id: int) -> set:
+        return self.extract_actionables(self.package_paths.get(package_id, []))
+
+    def package(self, package_id: int) -> ResolvedPackage:
+        return ResolvedPackage(package_id, self.purls.get(package_id))
+
+
+def scan_version(session, repository_id: int, environment: str = None) -> tuple:
+    """
+    Return what changes once a new scan of a repository finishes, or its vulnerable paths are
+    written again: when its latest wasp finished, and the number and highest id of its vulnerable
+    paths, in an environment or in all of them. Paths written again get new ids even if there are
+    as many of them.
+    """
+    finished = (
+        select(func.max(Wasp.finished_at))
+        .where(Wasp.repository_id == repository_id)
+        .scalar_subquery()
+    )
+    paths = (
+        select(func.count(), func.max(VulnerablePath.id))
+        .where(*path_filters(repository_id, environment))
+        .subquery()
+    )
+    return tuple(session.execute(select(finished, paths)).one())
+
+
+def path_filters(repository_id: int, environment=None, package_id=None, commons=None) -> list:
+    """
+    Return where clauses of vulnerable paths, None meaning any environment, package or commons
+    """
+    filters = [VulnerablePath.repository_id == repository_id]
+    if environment is not None:
+        filters.append(VulnerablePath.environment == environment)
+    if package_id is not None:
+        filters.append(VulnerablePath.vulnerable_package_id == package_id)
+    if commons is not None:
+        filters.append(VulnerablePath.has_commons_in_path.is_(commons))
+    return filters
+
+
+def resolve_purls(session, ids) -> dict:
+    if not ids:
+        return {}
+    return dict(session.execute(PURLS_QUERY, {"ids": list(ids)}).all())
+
+
+def page_of_packages(session, filters: list, after: int = None, limit: int = 100) -> list:
+    """
+    Return up to ``limit`` vulnerable packages of matching paths, ordered by id, after id ``after``
+    """
+    query = select(VulnerablePath.vulnerable_package_id).where(*filters).distinct()
+    if after is not None:
+        query = query.where(VulnerablePath.vulnerable_package_id > after)
+    query = query.order_by(VulnerablePath.vulnerable_package_id).limit(limit)
+    vulnerable_package_ids = session.scalars(query).all()
+    purls = resolve_purls(session, vulnerable_package_ids)
+    return [
+        ResolvedPackage(package_id, purls.get(package_id)) for package_id in vulnerable_package_ids
+    ]
+
+
+def page_of_paths(session, filters: list, after: int = None, limit: int = 100) -> list:
+    """
+    Return up to ``limit`` matching paths as dicts with their purls resolved, ordered by id, after
+    id ``after``
+    """
+    query = select(
+        VulnerablePath.id,
+        VulnerablePath.environment,
+        VulnerablePath.vulnerable_package_id,
+        VulnerablePath.has_commons_in_path,
+        VulnerablePath.path,
+        VulnerablePath.action_item,
+    ).where(*filters)
+    if after is not None:
+        query = query.where(VulnerablePath.id > after)
+    rows = session.execute(query.order_by(VulnerablePath.id).limit(limit)).all()
+
+    ids = set()
+    for row in rows:
+        ids.add(row.vulnerable_package_id)
+        ids.update(package_ids(row.path))
+    purls = resolve_purls(session, ids)
+
+    paths = []
+    for row in rows:
+        path = resolve_path(row.path, purls)
+        paths.append(
+            {
+                "id": row.id,
+                "environment": row.environment,
+                "vulnerable_package": ResolvedPackage(
+                    row.vulnerable_package_id, purls.get(row.vulnerable_package_id)
+                )._asdict(),
+                "has_commons_in_path": row.has_commons_in_path,
+                "path": path,
+                "actionable": None if row.action_item is None else path[int(row.action_item)],
+            }
+        )
+    return paths
+
+
+def page_of_actionables(session, filters: list, after: str = None, limit: int = 100) -> list:
+    """
+    Return up to ``limit`` (action item, purl) of matching paths, ordered by action item (a package
+    id or a purl, as stored in paths), after action item ``after``
+    """
+    action_item = VulnerablePath.path.op("->>", return_type=String)(
+        cast(VulnerablePath.action_item, Integer)
+    )
+    query = (
+        select(action_item.label("action_item"))
+        .where(*filters, VulnerablePath.action_item.is_not(None))
+        .distinct()
+    )
+    if after is not None:
+        query = query.where(action_item > after)
+    items = session.scalars(query.order_by(action_item).limit(limit)).all()
+    purls = resolve_purls(session, [int(item) for item in items if item.isdigit()])
+    return [(item, purls.get(int(item), item) if item.isdigit() else item) for item in items]
+
+
+class ActionableCache:
+    """
+    Keep up to ``size`` actionable views around for ``ttl`` seconds.
+
+    A cached view is used only while the repository's scan version is unchanged, which takes one
+    cheap query, so a new scan shows up as soon as it is done. The ttl bounds how stale a view can
+    get if ScanCode.io updates paths of a scan in place, keeping their ids.
+    """
+
+    def __init__(self, size=ACTIONABLE_CACHE_SIZE, ttl=ACTIONABLE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.views = OrderedDict()  # (repository_id, environment): (view, version, loaded_at)
+        self.lock = threading.Lock()
+
+    def get(self, session, repository_id: int, environment: str) -> ActionableView:
+        key = (int(repository_id), environment)
+        version = scan_version(session, *key)
+        with self.lock:
+            cached = self.views.get(key)
+            if cached and cached[1] == version and time.monotonic() - cached[2] < self.ttl:
+                self.views.move_to_end(key)
+                return cached[0]
+
+        view = ActionableView.load(session, *key)
+        with self.lock:
+            self.views[key] = (view, version, time.monotonic())
+            self.views.move_to_end(key)
+            while len(self.views) > self.size:
+                self.views.popitem(last=False)
+        return view
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+
+actionable_cache = ActionableCache()
@@ -6,6 +6,7 @@ from flask import request
 from flask import send_from_directory
 
 from libinv.api.actionable import actionable
+from libinv.api.fleet import fleet
 from libinv.api.graph import blastradius
 from libinv.api.wasp import wasp
 from libinv.base import conn
@@ -17,6 +18,7 @@ app = Flask(__name__)
 
 app.register_blueprint(actionable, url_prefix="/actionable")
 app.register_blueprint(blastradius, url_prefix="/blastradius")
+app.register_blueprint(fleet, url_prefix="/fleet")
 app.register_blueprint(wasp, url_prefix="/wasp")
 
 
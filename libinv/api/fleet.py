@@ -0,0 +1,36 @@
+from flask import Blueprint
+from flask import jsonify
+from flask import request
+
+from libinv.base import Session
+from libinv.blast_radius.fleet_graph import load_fleet_graph
+from libinv.package_index import find_package
+
+fleet = Blueprint("fleet", __name__)
+
+
+@fleet.route("/packages", methods=["GET"])
+def packages():
+    name = request.args.get("name")
+    if not name:
+        return jsonify({"error": "name parameter missing"}), 400
+
+    deployed_only = request.args.get("deployed", "false") == "true"
+    with Session() as session:
+        try:
+            found = find_package(session, name, request.args.get("version", ""), deployed_only)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify(found)
+
+
+@fleet.route("/affected", methods=["GET"])
+def affected():
+    package = request.args.get("package")
+    if not package:
+        return jsonify({"error": "package parameter missing"}), 400
+    try:
+        fleet_graph = load_fleet_graph()
+    except FileNotFoundError:
+        return jsonify({"error": "Fleet graph has not been built yet"}), 503
+    return jsonify(fleet_graph.affected(package))
@@ -1,34 +1,58 @@
-import networkx as nx
+import zlib
+
+from botocore.exceptions import ClientError
 from flask import Blueprint
+from flask import Response
 from flask import jsonify
 from flask import render_template
 from flask import request
 from pyvis.network import Network
 
-from libinv.blast_radius.cdx import cdx_to_graph
-from libinv.blast_radius.cdx import fetch_cdx_from_s3
+from libinv.blast_radius.cache import graph_cache
+from libinv.blast_radius.cache import load_index
+from libinv.blast_radius.cache import s3_client
 from libinv.blast_radius.cdx import minify_package_url
+from libinv.blast_radius.index import SBOM_SUFFIX
+from libinv.blast_radius.index import ReverseIndex
+from libinv.blast_radius.reachability import blast_radius_nodes
+from libinv.blast_radius.reachability import shortest_paths
+from libinv.env import BLAST_RADIUS_MAX_PATHS
+from libinv.env import S3_BUCKET_NAME
 
 blastradius = Blueprint("blastradius", __name__, template_folder="templates")
 
+SBOM_CHUNK_SIZE = 64 * 1024
+
+
+def sbom_key(project_name):
+    """
+    Return the S3 key of the SBOM of a ScanCode.io project named ``<wasp uuid><name>-<8 chars>``
+    """
+    return project_name[:36] + "/" + project_name[36:-9] + ".sbom.cdx.json"
+
+
+def load_graph(project_name):
+    """
+    Return the graph of a project's sbom from its reverse dependency index, or from the sbom for
+    projects scanned before indexes were
+    """
+    key = sbom_key(project_name)
+    index = load_index(key)
+    return index.graph if index else graph_cache.get(key)
 
-def get_graph(data, child_package):
-    parent_package = data["metadata"]["component"]["purl"]
-    graph = cdx_to_graph(parent_package, data)
 
-    # Find all paths from parent_package to child_package
-    all_paths = list(nx.all_simple_paths(graph, source=parent_package, target=child_package))
-    if not all_paths:
+def get_graph(graph, child_package):
+    parent_package = graph.root
+
+    # Nodes on any path from parent_package to child_package, without enumerating the paths
+    subgraph_nodes = blast_radius_nodes(graph, parent_package, child_package)
+    if not subgraph_nodes:
         print("No paths found from parent to child.")
-    else:
-        print(f"Paths found: {all_paths}")
 
     # Ensure to include the parent node in the subgraph nodes set
-    subgraph_nodes = {parent_package}
-    for path in all_paths:
-        subgraph_nodes.update(path)
+    subgraph_nodes.add(parent_package)
 
-    subgraph = graph.subgraph(subgraph_nodes)
+    subgraph = graph.to_networkx(subgraph_nodes)
 
     nt = Network(
         "900px",
@@ -47,13 +71,11 @@ def get_graph(data, child_package):
 
         node.update(label=minify_package_url(node.get("id")), title=node.get("id"))
 
-    if parent_package in subgraph_nodes:
-        nt.get_node(parent_package).update(color="#14452f")
-    else:
-        print(f"Parent node ({parent_package}) not in subgraph nodes: {subgraph_nodes}")
+    nt.get_node(parent_package).update(color="#14452f")
 
     # nt.inherit_edge_colors(True)
-    nt.get_node(child_package).update(color="#FF0000")
+    if child_package in subgraph_nodes:
+        nt.get_node(child_package).update(color="#FF0000")
     response = nt.generate_html()
     return response
 
@@ -70,20 +92,116 @@ def get_graph_api():
     child_package = request.args.get("child_package")
 
     if project_name and child_package:
-        project_name = project_name[:36] + "/" + project_name[36:-9] + ".sbom.cdx.json"
-        data = fetch_cdx_from_s3(project_name)
-        return get_graph(data, child_package)
+        return get_graph(load_graph(project_name), child_package)
+    else:
+        return jsonify({"error": "Project name not provided in the request"}), 400
+
+
+@blastradius.route("/paths", methods=["GET"])
+def get_paths_api():
+    project_name = request.args.get("project_name")
+    child_package = request.args.get("child_package")
+    max_paths = min(
+        request.args.get("max_paths", BLAST_RADIUS_MAX_PATHS, type=int), BLAST_RADIUS_MAX_PATHS
+    )
+
+    if project_name and child_package:
+        graph = load_graph(project_name)
+        paths = shortest_paths(graph, graph.root, child_package, k=max_paths)
+        return jsonify({"paths": paths})
+    else:
+        return jsonify({"error": "Project name not provided in the request"}), 400
+
+
+@blastradius.route("/dependents", methods=["GET"])
+def get_dependents_api():
+    project_name = request.args.get("project_name")
+    child_package = request.args.get("child_package")
+
+    if project_name and child_package:
+        key = sbom_key(project_name)
+        index = load_index(key) or ReverseIndex.from_graph(graph_cache.get(key))
+        dependents = index.dependents(child_package)
+        if dependents is None:
+            return jsonify({"error": "Package not found in the project"}), 404
+        return jsonify(dependents)
     else:
         return jsonify({"error": "Project name not provided in the request"}), 400
 
 
+def gzip_chunks(chunks):
+    """
+    Yield gzip compressed ``chunks`` of bytes as they come
+
+    >>> import gzip
+    >>> gzip.decompress(b"".join(gzip_chunks([b'{"bomFormat":', b' "CycloneDX"}'])))
+    b'{"bomFormat": "CycloneDX"}'
+    """
+    compressor = zlib.compressobj(wbits=31)  # 31 is gzip with its header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_body(body):
+    try:
+        yield from body.iter_chunks(SBOM_CHUNK_SIZE)
+    finally:
+        body.close()
+
+
 @blastradius.route("/sbom", methods=["GET"])
 def get_sbom():
+    """
+    Stream a project's sbom as it is in S3, gzipped if the client takes it. Range and conditional
+    requests are passed on to S3, so the sbom is never read whole here.
+    """
     project_name = request.args.get("project_name")
+    if not project_name:
+        return jsonify({"error": "Project name not provided in the request"}), 400
 
-    if project_name:
-        project_name = project_name + ".sbom.cdx.json"
-        data = fetch_cdx_from_s3(project_name)
-        return data
-
-    return jsonify({"error": "Project name not provided in the request"}), 400
+    # S3 has no If-Range, so ranges that come with one are ignored and the whole sbom is sent
+    ranged = request.range is not None and "If-Range" not in request.headers
+    # ranges are of the bytes as stored, so those are never gzipped
+    gzipped = not ranged and bool(request.accept_encodings["gzip"])
+    s3_request = {"Bucket": S3_BUCKET_NAME, "Key": project_name + SBOM_SUFFIX}
+    if ranged:
+        s3_request["Range"] = request.headers["Range"]
+    if request.if_none_match:
+        # gzipped responses have weak etags, which S3 knows as strong ones
+        s3_request["IfNoneMatch"] = request.headers["If-None-Match"].replace("W/", "")
+    if request.if_modified_since:
+        s3_request["IfModifiedSince"] = request.if_modified_since
+    try:
+        s3_response = s3_client().get_object(**s3_request)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code in ("304", "NotModified"):
+            response = Response(status=304)
+            response.headers["Vary"] = "Accept-Encoding"
+            etag = e.response["ResponseMetadata"]["HTTPHeaders"].get("etag")
+            if etag:
+                response.set_etag(etag.strip('"'), weak=gzipped)
+            return response
+        if code in ("NoSuchKey", "404"):
+            return jsonify({"error": "SBOM not found"}), 404
+        if code in ("InvalidRange", "416"):
+            return jsonify({"error": "Range not satisfiable"}), 416
+        raise
+
+    body = stream_body(s3_response["Body"])
+    response = Response(gzip_chunks(body) if gzipped else body, mimetype="application/json")
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.set_etag(s3_response["ETag"].strip('"'), weak=gzipped)
+    response.last_modified = s3_response["LastModified"]
+    if gzipped:
+        response.content_encoding = "gzip"
+    else:
+        response.content_length = s3_response["ContentLength"]
+    if "ContentRange" in s3_response:
+        response.status_code = 206
+        response.headers["Content-Range"] = s3_response["ContentRange"]
+    return response
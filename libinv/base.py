@@ -1,4 +1,6 @@
 # base class declared
+import threading
+
 import sqlalchemy as db
 from sqlalchemy import MetaData
 from sqlalchemy import Table
@@ -18,5 +20,7 @@ class LibinvBase:
 Base = declarative_base(cls=LibinvBase)
 
 conn = Session()
+# conn is not thread safe, hold this lock when using it from more than one thread
+session_lock = threading.RLock()
 
 metadata = MetaData()
@@ -0,0 +1,119 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from attrs import define
+from botocore.exceptions import ClientError
+
+from libinv.blast_radius.compact import CompactGraph
+from libinv.blast_radius.index import ReverseIndex
+from libinv.blast_radius.index import reverse_index_key
+from libinv.env import GRAPH_CACHE_BYTES
+from libinv.env import GRAPH_CACHE_FRESH_FOR
+from libinv.env import S3_BUCKET_NAME
+from libinv.helpers import get_boto3_client
+
+logger = logging.getLogger("libinv.blast_radius")
+
+
+@lru_cache(maxsize=None)
+def s3_client():
+    return get_boto3_client("s3")  # boto3 clients are thread safe, so one is shared
+
+
+@define
+class Cached:
+    key: str
+    etag: str
+    value: object
+    size: int
+    checked_at: float  # monotonic time the etag was last checked against s3
+
+
+class S3Cache:
+    """
+    Keep objects in S3 around as parsed by ``parse(body)``, least recently used ones being dropped
+    once they take more than ``budget`` bytes, going by the ``nbytes`` of parsed objects.
+
+    A cached object is used as is for ``fresh_for`` seconds. After that it is checked with a
+    conditional GET on its ETag, and it is downloaded and parsed again only if it changed.
+    """
+
+    def __init__(self, parse, budget=GRAPH_CACHE_BYTES, fresh_for=GRAPH_CACHE_FRESH_FOR):
+        self.parse = parse
+        self.budget = budget
+        self.fresh_for = fresh_for
+        self.objects = OrderedDict()  # s3 key: Cached
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        return self.get_cached(key).value
+
+    def get_cached(self, key: str) -> Cached:
+        with self.lock:
+            cached = self.objects.get(key)
+            if cached:
+                self.objects.move_to_end(key)
+        if cached and time.monotonic() - cached.checked_at < self.fresh_for:
+            return cached
+
+        request = {"Bucket": S3_BUCKET_NAME, "Key": key}
+        if cached:
+            request["IfNoneMatch"] = cached.etag
+        try:
+            response = s3_client().get_object(**request)
+        except ClientError as e:
+            if cached and e.response["Error"]["Code"] in ("304", "NotModified"):
+                cached.checked_at = time.monotonic()
+                return cached
+            raise
+
+        value = self.parse(response["Body"].read())
+        cached = Cached(key, response["ETag"], value, value.nbytes, time.monotonic())
+        self.put(cached)
+        return cached
+
+    def put(self, cached: Cached):
+        with self.lock:
+            self.objects[cached.key] = cached
+            self.objects.move_to_end(cached.key)
+            # the object just put is kept even if it alone is over budget
+            while len(self.objects) > 1 and self.used() > self.budget:
+                _, dropped = self.objects.popitem(last=False)
+                logger.debug(f"Dropped {dropped.key} from cache")
+
+    def used(self) -> int:
+        return sum(cached.size for cached in self.objects.values())
+
+
+graph_cache = S3Cache(parse=lambda body: CompactGraph.from_cdx(json.loads(body)))
+index_cache = S3Cache(parse=ReverseIndex.loads)
+missing_indexes = {}  # sbom key: (etag of the sbom, monotonic time its index was found missing)
+
+
+def load_index(sbom_key: str):
+    """
+    Return the reverse dependency index of an sbom, None if it has none, as with sboms scanned
+    before indexes were. A missing index is remembered against the ETag of its sbom and looked for
+    again only once the sbom changes or ``fresh_for`` seconds pass, so that such sboms don't cost
+    a failing GET on every request.
+    """
+    missing = missing_indexes.get(sbom_key)
+    if missing:
+        etag, checked_at = missing
+        fresh = time.monotonic() - checked_at < index_cache.fresh_for
+        if fresh and graph_cache.get_cached(sbom_key).etag == etag:
+            return None
+
+    try:
+        index = index_cache.get(reverse_index_key(sbom_key))
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        missing_indexes[sbom_key] = (graph_cache.get_cached(sbom_key).etag, time.monotonic())
+        return None
+    missing_indexes.pop(sbom_key, None)
+    return index
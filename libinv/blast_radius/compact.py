@@ -0,0 +1,161 @@
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+import networkx as nx
+
+
+def csr(size: int, pairs) -> tuple:
+    """
+    Return (offsets, targets) of edges given as (source, target) id pairs, the targets of node ``i``
+    being ``targets[offsets[i]:offsets[i + 1]]``
+
+    >>> offsets, targets = csr(3, [(0, 2), (0, 1), (2, 1)])
+    >>> list(offsets), list(targets)
+    ([0, 2, 2, 3], [1, 2, 1])
+    """
+    pairs = sorted(pairs)
+    offsets = array("I", [0]) * (size + 1)
+    for source, _ in pairs:
+        offsets[source + 1] += 1
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    return offsets, array("I", [target for _, target in pairs])
+
+
+class CompactGraph:
+    """
+    A read-only dependency graph that takes a fraction of the memory networkx does.
+
+    Purls are interned to integer ids, their index in a sorted list, and edges are kept in
+    compressed sparse row arrays, both ways, so that reachability is a breadth first search over
+    machine ints. Convert only the few nodes that are drawn to networkx with ``to_networkx``.
+
+    >>> graph = CompactGraph.from_edges([("app", "a"), ("a", "log4j"), ("app", "b")])
+    >>> len(graph), graph.number_of_edges(), "log4j" in graph
+    (4, 3, True)
+    >>> [graph.purls[i] for i in graph.successors(graph.id("app"))]
+    ['a', 'b']
+    >>> sorted(graph.purls[i] for i in graph.reachable_ids(graph.id("log4j"), reverse=True))
+    ['a', 'app', 'log4j']
+    >>> sorted(graph.to_networkx(["app", "a", "log4j"]).edges)
+    [('a', 'log4j'), ('app', 'a')]
+    """
+
+    def __init__(self, purls: list, pairs, root: str = None):
+        self.purls = purls  # sorted, a purl's id is its index
+        self.root = root  # purl of the project, for a graph of a project's sbom
+        pairs = list(pairs)
+        self.offsets, self.targets = csr(len(purls), pairs)
+        self.reverse_offsets, self.reverse_targets = csr(
+            len(purls), ((target, source) for source, target in pairs)
+        )
+
+    @classmethod
+    def from_edges(cls, edges, nodes=(), root: str = None):
+        edges = [(source, target) for source, target in edges if source and target]
+        purls = sorted({*filter(None, nodes), *(purl for edge in edges for purl in edge)})
+        ids = {purl: i for i, purl in enumerate(purls)}  # only while building
+        return cls(purls, {(ids[source], ids[target]) for source, target in edges}, root)
+
+    @classmethod
+    def from_cdx(cls, cdx: dict, root: str = None):
+        """
+        Return the graph of a CDX SBOM, components being its nodes and the project (``root``, or
+        the sbom's metadata component) its root
+        """
+        root = root or cdx["metadata"]["component"]["purl"]
+        nodes = [root, *(component.get("bom-ref") for component in cdx.get("components", []))]
+        edges = [
+            (dependency.get("ref"), depends_on)
+            for dependency in cdx.get("dependencies", [])
+            for depends_on in dependency.get("dependsOn", [])
+        ]
+        return cls.from_edges(edges, nodes, root)
+
+    def __len__(self):
+        return len(self.purls)
+
+    def __contains__(self, purl):
+        i = bisect_left(self.purls, purl)
+        return i < len(self.purls) and self.purls[i] == purl
+
+    def id(self, purl: str) -> int:
+        if purl not in self:
+            raise KeyError(purl)
+        return bisect_left(self.purls, purl)
+
+    def number_of_edges(self) -> int:
+        return len(self.targets)
+
+    def successors(self, i: int):
+        return self.targets[self.offsets[i] : self.offsets[i + 1]]
+
+    def predecessors(self, i: int):
+        return self.reverse_targets[self.reverse_offsets[i] : self.reverse_offsets[i + 1]]
+
+    def reachable(self, start: int, reverse=False) -> bytearray:
+        """
+        Return a mask of ids reachable from id ``start``, itself included, following edges
+        backwards if ``reverse``
+        """
+        offsets, targets = self.offsets, self.targets
+        if reverse:
+            offsets, targets = self.reverse_offsets, self.reverse_targets
+        seen = bytearray(len(self.purls))
+        seen[start] = 1
+        queue = deque([start])
+        while queue:
+            i = queue.popleft()
+            for j in targets[offsets[i] : offsets[i + 1]]:
+                if not seen[j]:
+                    seen[j] = 1
+                    queue.append(j)
+        return seen
+
+    def distances(self, start: int, reverse=False) -> array:
+        """
+        Return hops from id ``start`` to every id, -1 for those not reachable, following edges
+        backwards if ``reverse``
+        """
+        offsets, targets = self.offsets, self.targets
+        if reverse:
+            offsets, targets = self.reverse_offsets, self.reverse_targets
+        distances = array("i", [-1]) * len(self.purls)
+        distances[start] = 0
+        queue = deque([start])
+        while queue:
+            i = queue.popleft()
+            for j in targets[offsets[i] : offsets[i + 1]]:
+                if distances[j] < 0:
+                    distances[j] = distances[i] + 1
+                    queue.append(j)
+        return distances
+
+    def reachable_ids(self, start: int, reverse=False) -> list:
+        return [i for i, seen in enumerate(self.reachable(start, reverse)) if seen]
+
+    def to_networkx(self, purls) -> nx.DiGraph:
+        """
+        Return the subgraph of given purls as a networkx graph, for drawing or path finding
+        """
+        ids = {self.id(purl) for purl in purls}
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.purls[i] for i in ids)
+        graph.add_edges_from(
+            (self.purls[i], self.purls[j]) for i in ids for j in self.successors(i) if j in ids
+        )
+        return graph
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Return bytes the graph takes in memory
+        """
+        arrays = (self.offsets, self.targets, self.reverse_offsets, self.reverse_targets)
+        return (
+            sys.getsizeof(self.purls)
+            + sum(sys.getsizeof(purl) for purl in self.purls)
+            + sum(len(a) * a.itemsize for a in arrays)
+        )
@@ -0,0 +1,373 @@
+import fcntl
+import json
+import logging
+import os
+import sys
+import threading
+import zipfile
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+from sqlalchemy import select
+
+from libinv.blast_radius.cache import s3_client
+from libinv.blast_radius.compact import CompactGraph
+from libinv.blast_radius.index import ReverseIndex
+from libinv.blast_radius.index import reverse_index_key
+from libinv.env import FLEET_GRAPH_PATH
+from libinv.env import S3_BUCKET_NAME
+from libinv.models import Repository
+from libinv.models import Wasp
+
+logger = logging.getLogger("libinv.blast_radius")
+
+FORMAT_VERSION = 1
+EDGE_FILES = ("sources.bin", "targets.bin", "tags.bin")
+REVERSE_FILES = ("reverse_offsets.bin", "reverse_sources.bin", "reverse_tags.bin")
+
+
+def package_name(purl: str) -> str:
+    """
+    Return a purl without its version, qualifiers and subpath
+
+    >>> package_name("pkg:maven/org.apache.logging.log4j/log4j-core@2.14.1?type=jar")
+    'pkg:maven/org.apache.logging.log4j/log4j-core'
+    """
+    return purl.split("?")[0].split("#")[0].split("@")[0]
+
+
+@contextmanager
+def locked(path=FLEET_GRAPH_PATH):
+    """
+    Hold an exclusive lock on the fleet graph at ``path`` while it is read, changed and saved
+    """
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with open(path.with_name(path.name + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class FleetGraph:
+    """
+    Dependency graphs of every project merged into one, so that a package can be traced to every
+    project that pulls it in.
+
+    Purls are interned across projects, so a package shared by many projects is one node. Each edge
+    is tagged with the project it is in, and paths only follow edges of one project, as the same
+    package may depend on different things in different projects. Edges are three arrays of ints
+    (source, target, project), saved as they are in a zip that loads with no parsing.
+
+    >>> fleet = FleetGraph()
+    >>> web = CompactGraph.from_edges([("web", "spring"), ("spring", "log4j@2.14")], root="web")
+    >>> api = CompactGraph.from_edges([("api", "spring"), ("api", "log4j@2.17")], root="api")
+    >>> fleet.update(
+    ...     {
+    ...         "org/web": (web, "web.sbom.cdx.json", 1, '"e1"'),
+    ...         "org/api": (api, "api.sbom.cdx.json", 2, '"e2"'),
+    ...     }
+    ... )
+    >>> fleet.affected("log4j@2.14")
+    {'org/web': {'sbom': 'web.sbom.cdx.json', 'path': ['web', 'spring', 'log4j@2.14']}}
+    >>> sorted(fleet.affected("log4j"))
+    ['org/api', 'org/web']
+    >>> fleet.affected("spring")["org/api"]["path"]
+    ['api', 'spring']
+    """
+
+    def __init__(self, purls=None, projects=None, edges=None, updated_until=None):
+        self.purls = purls or []  # purl of each id
+        self.ids = {purl: i for i, purl in enumerate(self.purls)}
+        # {"name", "root" (purl id), "sbom", "wasp_id", "etag" (of what it was loaded from)} of each
+        self.projects = projects or []
+        self.project_ids = {project["name"]: i for i, project in enumerate(self.projects)}
+        self.sources, self.targets, self.tags = edges or (array("I"), array("I"), array("I"))
+        self.updated_until = updated_until  # iso time, wasps updated before it are in the graph
+        self.reverse = None  # (offsets, sources, tags) of edges by target and project, once needed
+
+    def __len__(self):
+        return len(self.purls)
+
+    def number_of_edges(self) -> int:
+        return len(self.targets)
+
+    def intern(self, purl: str) -> int:
+        if purl not in self.ids:
+            self.ids[purl] = len(self.purls)
+            self.purls.append(purl)
+        return self.ids[purl]
+
+    def update(self, graphs: dict):
+        """
+        Replace the edges of projects with those of their graphs, given as name: (graph, sbom key,
+        wasp id, etag)
+        """
+        for name in graphs:
+            if name not in self.project_ids:
+                self.project_ids[name] = len(self.projects)
+                self.projects.append({"name": name, "root": None, "sbom": None, "wasp_id": 0})
+        replaced = {self.project_ids[name] for name in graphs}
+
+        kept = [i for i, tag in enumerate(self.tags) if tag not in replaced]
+        self.sources = array("I", [self.sources[i] for i in kept])
+        self.targets = array("I", [self.targets[i] for i in kept])
+        self.tags = array("I", [self.tags[i] for i in kept])
+
+        for name, (graph, sbom, wasp_id, etag) in graphs.items():
+            project_id = self.project_ids[name]
+            ids = [self.intern(purl) for purl in graph.purls]
+            for i in range(len(graph)):
+                for j in graph.successors(i):
+                    self.sources.append(ids[i])
+                    self.targets.append(ids[j])
+                    self.tags.append(project_id)
+            root = graph.root if graph.root in graph else None
+            root = None if root is None else self.intern(root)
+            self.projects[project_id].update(root=root, sbom=sbom, wasp_id=wasp_id, etag=etag)
+
+        self.drop_unused_purls()
+        self.reverse = None
+
+    def drop_unused_purls(self):
+        used = {*self.sources, *self.targets}
+        used.update(project["root"] for project in self.projects if project["root"] is not None)
+        if len(used) == len(self.purls):
+            return
+        new_ids = {old: new for new, old in enumerate(sorted(used))}
+        self.purls = [self.purls[old] for old in sorted(used)]
+        self.ids = {purl: i for i, purl in enumerate(self.purls)}
+        self.sources = array("I", [new_ids[i] for i in self.sources])
+        self.targets = array("I", [new_ids[i] for i in self.targets])
+        for project in self.projects:
+            if project["root"] is not None:
+                project["root"] = new_ids[project["root"]]
+
+    def reverse_edges(self) -> tuple:
+        """
+        Return (offsets, sources, tags) of edges ordered by target and project: edges into ``i`` of
+        project ``p`` are the run of ``tags[offsets[i]:offsets[i + 1]]`` equal to ``p``
+        """
+        if self.reverse is None:
+            projects = len(self.projects)
+            order = sorted(
+                range(len(self.targets)), key=lambda e: self.targets[e] * projects + self.tags[e]
+            )
+            offsets = array("I", [0]) * (len(self.purls) + 1)
+            for target in self.targets:
+                offsets[target + 1] += 1
+            for i in range(len(self.purls)):
+                offsets[i + 1] += offsets[i]
+            sources = array("I", [self.sources[e] for e in order])
+            tags = array("I", [self.tags[e] for e in order])
+            self.reverse = offsets, sources, tags
+        return self.reverse
+
+    def matching(self, package: str) -> list:
+        """
+        Return ids of a purl, or of every version of a package if it is given without one
+        """
+        if package in self.ids:
+            return [self.ids[package]]
+        if "@" in package:
+            return []
+        return [i for i, purl in enumerate(self.purls) if package_name(purl) == package]
+
+    def affected(self, package: str) -> dict:
+        """
+        Return projects that pull in a package (a purl, or one without a version for any version),
+        each with its sbom and a shortest path from the project to the package
+        """
+        offsets, sources, tags = self.reverse_edges()
+        roots = {project["root"]: i for i, project in enumerate(self.projects)}
+
+        # Search backwards over (purl id, project id) states, edges of one project at a time
+        came_from = {}
+        queue = deque()
+        for target in self.matching(package):
+            for project_id in set(tags[offsets[target] : offsets[target + 1]]):
+                came_from[(target, project_id)] = None
+                queue.append((target, project_id))
+
+        affected = {}
+        while queue:
+            state = queue.popleft()
+            node, project_id = state
+            if roots.get(node) == project_id and project_id not in affected:
+                affected[project_id] = self.path(state, came_from)
+            lo = bisect_left(tags, project_id, offsets[node], offsets[node + 1])
+            hi = bisect_right(tags, project_id, lo, offsets[node + 1])
+            for source in sources[lo:hi]:
+                if (source, project_id) not in came_from:
+                    came_from[(source, project_id)] = state
+                    queue.append((source, project_id))
+
+        return {
+            self.projects[project_id]["name"]: {
+                "sbom": self.projects[project_id]["sbom"],
+                "path": path,
+            }
+            for project_id, path in sorted(
+                affected.items(), key=lambda item: self.projects[item[0]]["name"]
+            )
+        }
+
+    def path(self, state, came_from) -> list:
+        path = []
+        while state is not None:
+            path.append(self.purls[state[0]])
+            state = came_from[state]
+        return path
+
+    def save(self, path=FLEET_GRAPH_PATH):
+        """
+        Write the graph to a zip at ``path``, replacing it at once so that readers never see a
+        partly written one
+        """
+        path = Path(path)
+        meta = {
+            "version": FORMAT_VERSION,
+            "byteorder": sys.byteorder,
+            "updated_until": self.updated_until,
+            "projects": self.projects,
+        }
+        temporary = path.with_name(f".{path.name}.{os.getpid()}")
+        with zipfile.ZipFile(temporary, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("meta.json", json.dumps(meta))
+            archive.writestr("purls.txt", "\n".join(self.purls))
+            for name, edge_ends in zip(EDGE_FILES, (self.sources, self.targets, self.tags)):
+                archive.writestr(name, edge_ends.tobytes())
+            # the reverse edges too, as sorting them takes longer than reading them
+            for name, reverse in zip(REVERSE_FILES, self.reverse_edges()):
+                archive.writestr(name, reverse.tobytes())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path=FLEET_GRAPH_PATH):
+        """
+        Return the graph saved at ``path``, an empty one if there is none
+        """
+        if not Path(path).exists():
+            return cls()
+        with zipfile.ZipFile(path) as archive:
+            meta = json.loads(archive.read("meta.json"))
+            if meta["version"] != FORMAT_VERSION:
+                raise ValueError(f"Unknown fleet graph version {meta['version']}")
+            purls = archive.read("purls.txt").decode().split("\n")
+            edges, reverse = [], []
+            for names, arrays in ((EDGE_FILES, edges), (REVERSE_FILES, reverse)):
+                for name in names:
+                    ints = array("I")
+                    ints.frombytes(archive.read(name))
+                    if meta["byteorder"] != sys.byteorder:
+                        ints.byteswap()
+                    arrays.append(ints)
+        fleet = cls(purls if purls != [""] else [], meta["projects"], edges, meta["updated_until"])
+        fleet.reverse = tuple(reverse)
+        return fleet
+
+
+def project_graph(sbom: str, etag: str = None):
+    """
+    Return (graph, etag) of an uploaded sbom from its reverse dependency index, or from the sbom for
+    projects scanned before indexes were. If ``etag`` is given, return None if what the graph was
+    loaded from has not changed since.
+    """
+    sources = [
+        (reverse_index_key(sbom), lambda body: ReverseIndex.loads(body).graph),
+        (sbom, lambda body: CompactGraph.from_cdx(json.loads(body))),
+    ]
+    for key, parse in sources:
+        request = {"Bucket": S3_BUCKET_NAME, "Key": key}
+        if etag:
+            request["IfNoneMatch"] = etag
+        try:
+            response = s3_client().get_object(**request)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in ("304", "NotModified"):
+                return None
+            if code in ("NoSuchKey", "404") and key != sbom:
+                continue
+            raise
+        return parse(response["Body"].read()), response["ETag"]
+
+
+def update_fleet_graph(session, path=FLEET_GRAPH_PATH, full=False) -> FleetGraph:
+    """
+    Merge sboms uploaded since the fleet graph at ``path`` was last updated into it, the latest one
+    of each repository replacing what the graph had of it, or rebuild it from scratch if ``full``
+    """
+    with locked(path):
+        fleet = FleetGraph() if full else FleetGraph.load(path)
+        wasps = select(Wasp.id, Wasp.stages, Wasp.updated_at, Repository.org, Repository.name).join(
+            Repository, Repository.id == Wasp.repository_id
+        )
+        updated_until = fleet.updated_until and datetime.fromisoformat(fleet.updated_until)
+        if updated_until:
+            # a wasp is updated as each of its stages is done, so one that was still scanning
+            # last time shows up again once its sbom is uploaded
+            wasps = wasps.where(Wasp.updated_at >= updated_until)
+
+        latest = {}  # repository: (wasp id, sbom key, updated at, etag if it may be unchanged)
+        for wasp in session.execute(wasps.order_by(Wasp.id)):
+            if wasp.updated_at and (updated_until is None or wasp.updated_at > updated_until):
+                updated_until = wasp.updated_at
+            sbom = (wasp.stages or {}).get("upload")
+            name = f"{wasp.org}/{wasp.name}"
+            project_id = fleet.project_ids.get(name)
+            project = {"wasp_id": 0} if project_id is None else fleet.projects[project_id]
+            if not sbom or wasp.id < project["wasp_id"]:
+                continue
+            # the same wasp may have uploaded its sbom again, which its etag tells
+            same = wasp.id == project["wasp_id"] and sbom == project["sbom"]
+            latest[name] = (wasp.id, sbom, wasp.updated_at, project.get("etag") if same else None)
+
+        graphs = {}
+        failed = []  # update times of wasps whose sboms could not be loaded
+        for name, (wasp_id, sbom, updated_at, etag) in latest.items():
+            try:
+                loaded = project_graph(sbom, etag)
+            except (ClientError, KeyError, ValueError) as e:
+                logger.warning(f"Could not load sbom {sbom} of {name}: {e}")
+                if updated_at:
+                    failed.append(updated_at)
+                continue
+            if loaded:  # else it is unchanged
+                graph, etag = loaded
+                graphs[name] = (graph, sbom, wasp_id, etag)
+        fleet.update(graphs)
+        if failed:  # so that they are tried again next time
+            updated_until = min(failed)
+        fleet.updated_until = updated_until and updated_until.isoformat()
+        fleet.save(path)
+        logger.info(
+            f"Merged {len(graphs)} sboms into the fleet graph, now {len(fleet)} packages and"
+            f" {fleet.number_of_edges()} edges of {len(fleet.projects)} projects"
+        )
+        return fleet
+
+
+_loaded = {}  # path: (mtime, FleetGraph)
+_loaded_lock = threading.Lock()
+
+
+def load_fleet_graph(path=FLEET_GRAPH_PATH) -> FleetGraph:
+    """
+    Return the fleet graph at ``path``, loading it again only once it has been updated. Raise
+    FileNotFoundError if it has not been built, as an empty graph would tell that nothing is
+    affected.
+    """
+    mtime = os.stat(path).st_mtime
+    with _loaded_lock:
+        if path not in _loaded or _loaded[path][0] != mtime:
+            _loaded[path] = (mtime, FleetGraph.load(path))
+        return _loaded[path][1]
@@ -0,0 +1,115 @@
+import json
+from pathlib import Path
+
+from libinv.blast_radius.compact import CompactGraph
+from libinv.blast_radius.compact import csr
+
+SBOM_SUFFIX = ".sbom.cdx.json"
+INDEX_SUFFIX = ".rdeps.json"
+INDEX_VERSION = 1
+
+
+def reverse_index_key(sbom_key: str) -> str:
+    """
+    Return where the reverse dependency index of an sbom is kept, next to it
+
+    >>> reverse_index_key("0d5c7f5e-6d9c-4d3e-9c5e-1f8a8d3f0b1e/libinv.sbom.cdx.json")
+    '0d5c7f5e-6d9c-4d3e-9c5e-1f8a8d3f0b1e/libinv.rdeps.json'
+    """
+    return sbom_key.removesuffix(SBOM_SUFFIX) + INDEX_SUFFIX
+
+
+class ReverseIndex:
+    """
+    Who pulls in each component of a project: the components that depend on it directly (its
+    parents) and the project's direct dependencies it comes in through (its owners).
+
+    It is built once from the sbom when a project is scanned and stored next to it, so that "who
+    pulls in this package" is a lookup. Ancestors are found following parents, which only visits
+    the ancestors. Its graph is that of the sbom, so it stands in for the sbom in blast radius.
+
+    >>> graph = CompactGraph.from_edges(
+    ...     [("app", "web"), ("app", "db"), ("web", "log4j"), ("db", "log4j"), ("db", "pg")],
+    ...     root="app",
+    ... )
+    >>> index = ReverseIndex.loads(ReverseIndex.from_graph(graph).dumps())
+    >>> index.dependents("log4j")
+    {'parents': ['db', 'web'], 'owners': ['db', 'web'], 'ancestors': ['app', 'db', 'web']}
+    >>> index.dependents("pg")["owners"]
+    ['db']
+    """
+
+    def __init__(self, graph: CompactGraph, owner_offsets, owner_targets):
+        self.graph = graph
+        self.owner_offsets = owner_offsets
+        self.owner_targets = owner_targets
+
+    @classmethod
+    def from_graph(cls, graph: CompactGraph):
+        owners = []  # (component, owner) id pairs
+        if graph.root in graph:
+            for owner in graph.successors(graph.id(graph.root)):
+                owners.extend((i, owner) for i in graph.reachable_ids(owner))
+        return cls(graph, *csr(len(graph), owners))
+
+    @classmethod
+    def from_sbom(cls, path: Path):
+        with open(path) as sbom:
+            return cls.from_graph(CompactGraph.from_cdx(json.load(sbom)))
+
+    @classmethod
+    def loads(cls, body):
+        index = json.loads(body)
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unknown reverse dependency index version {index.get('version')}")
+        parents = (
+            (parent, i) for i, component in enumerate(index["parents"]) for parent in component
+        )
+        owners = ((i, owner) for i, component in enumerate(index["owners"]) for owner in component)
+        graph = CompactGraph(index["purls"], parents, index["root"])
+        return cls(graph, *csr(len(graph), owners))
+
+    def dumps(self) -> str:
+        graph = self.graph
+        return json.dumps(
+            {
+                "version": INDEX_VERSION,
+                "root": graph.root,
+                "purls": graph.purls,
+                "parents": [list(graph.predecessors(i)) for i in range(len(graph))],
+                "owners": [list(self.owners(i)) for i in range(len(graph))],
+            },
+            separators=(",", ":"),
+        )
+
+    def owners(self, i: int):
+        return self.owner_targets[self.owner_offsets[i] : self.owner_offsets[i + 1]]
+
+    def dependents(self, purl: str) -> dict:
+        """
+        Return purls of parents, owners and ancestors of a component, None if it's not in the index
+        """
+        graph = self.graph
+        if purl not in graph:
+            return None
+        i = graph.id(purl)
+        ancestors = [j for j in graph.reachable_ids(i, reverse=True) if j != i]
+        return {
+            "parents": [graph.purls[j] for j in graph.predecessors(i)],
+            "owners": [graph.purls[j] for j in self.owners(i)],
+            "ancestors": [graph.purls[j] for j in ancestors],
+        }
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.owner_offsets, self.owner_targets)
+        return self.graph.nbytes + sum(len(a) * a.itemsize for a in arrays)
+
+
+def write_reverse_index(sbom: Path) -> Path:
+    """
+    Write the reverse dependency index of an sbom file next to it and return its path
+    """
+    path = Path(reverse_index_key(str(sbom)))
+    path.write_text(ReverseIndex.from_sbom(sbom).dumps())
+    return path
@@ -0,0 +1,78 @@
+import heapq
+import time
+
+from libinv.blast_radius.compact import CompactGraph
+from libinv.env import BLAST_RADIUS_MAX_PATHS
+from libinv.env import BLAST_RADIUS_TIME_BUDGET
+
+
+def blast_radius_nodes(graph: CompactGraph, root, target) -> set:
+    """
+    Return purls on some path from ``root`` to ``target``: those reachable from the root that the
+    target is reachable from. Unlike enumerating paths, this takes linear time on any graph.
+
+    >>> edges = [("app", "a"), ("a", "log4j"), ("app", "b"), ("b", "c"), ("x", "log4j")]
+    >>> graph = CompactGraph.from_edges(edges)
+    >>> sorted(blast_radius_nodes(graph, "app", "log4j"))
+    ['a', 'app', 'log4j']
+    >>> blast_radius_nodes(graph, "app", "x")
+    set()
+    """
+    if root not in graph or target not in graph:
+        return set()
+    forward = graph.reachable(graph.id(root))
+    if not forward[graph.id(target)]:
+        return set()
+    backward = graph.reachable(graph.id(target), reverse=True)
+    return {
+        graph.purls[i]
+        for i, (ahead, behind) in enumerate(zip(forward, backward))
+        if ahead and behind
+    }
+
+
+def shortest_paths(
+    graph: CompactGraph,
+    root,
+    target,
+    k=BLAST_RADIUS_MAX_PATHS,
+    time_budget=BLAST_RADIUS_TIME_BUDGET,
+) -> list:
+    """
+    Return up to ``k`` shortest simple paths from ``root`` to ``target``, shortest first, as many as
+    are found in ``time_budget`` seconds.
+
+    Paths are grown best first, ranked by their hops so far plus the hops left to the target,
+    which are known exactly from a breadth first search backwards from it. So paths come out in
+    order of length, each in time about its length, and the budget is checked at every step.
+
+    >>> edges = [("app", "a"), ("a", "log4j"), ("app", "b"), ("b", "c"), ("c", "log4j")]
+    >>> graph = CompactGraph.from_edges(edges)
+    >>> shortest_paths(graph, "app", "log4j", k=1)
+    [['app', 'a', 'log4j']]
+    >>> shortest_paths(graph, "app", "log4j")
+    [['app', 'a', 'log4j'], ['app', 'b', 'c', 'log4j']]
+    >>> shortest_paths(graph, "log4j", "app")
+    []
+    """
+    if root not in graph or target not in graph:
+        return []
+    source, sink = graph.id(root), graph.id(target)
+    to_target = graph.distances(sink, reverse=True)
+    if to_target[source] < 0:
+        return []
+
+    deadline = time.monotonic() + time_budget
+    # (hops so far + hops left, -hops so far to go deeper first on a tie, path of ids)
+    heap = [(to_target[source], 0, (source,))]
+    paths = []
+    while heap and len(paths) < k and time.monotonic() < deadline:
+        _, _, path = heapq.heappop(heap)
+        if path[-1] == sink:
+            paths.append(path)
+            continue
+        hops = len(path)
+        for i in graph.successors(path[-1]):
+            if to_target[i] >= 0 and i not in path:
+                heapq.heappush(heap, (hops + to_target[i], -hops, path + (i,)))
+    return [[graph.purls[i] for i in path] for path in paths]
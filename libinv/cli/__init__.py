@@ -2,12 +2,16 @@ import logging
 
 import click
 
+from libinv.cli.backfill import backfill
 from libinv.cli.bridge import connect
 from libinv.cli.checkpoint import checkpoint
 from libinv.cli.daemon import daemon
+from libinv.cli.fleet_graph import fleet_graph
+from libinv.cli.forward import forward
 from libinv.cli.import_and_improve_from_metapod import import_and_improve_from_metapod
 from libinv.cli.process_message import process_message
 from libinv.cli.query import sbom
+from libinv.cli.replay import replay
 from libinv.cli.scan_stage_ecr_image import scan_stage_ecr_image
 from libinv.cli.secbugs import secbugs_connect
 from libinv.cli.update_all_images_with_base_image import update_all_images_with_base_images
@@ -0,0 +1,186 @@
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from datetime import timedelta
+
+import click
+from sqlalchemy import func
+from sqlalchemy import select
+from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
+
+from libinv import Session
+from libinv.cli.cli import cli
+from libinv.daemon.pool import WORKER_CONTEXT
+from libinv.daemon.pool import init_worker
+from libinv.helpers import explode_git_url
+from libinv.main import process_message
+from libinv.models import Repository
+from libinv.models import Wasp
+
+
+def backfill_message(raw_message):
+    """
+    Return (acknowledged, error) after scanning a stored message again
+    """
+    try:
+        return bool(process_message({"Body": raw_message, "ReceiptHandle": ""})), None
+    except Exception:
+        return False, traceback.format_exc()
+
+
+def new_executor(workers):
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=WORKER_CONTEXT, initializer=init_worker
+    )
+
+
+def repository_full_name(repository: str) -> str:
+    """
+    >>> repository_full_name("git@github.com:gitorg/Libinv.git")
+    'gitorg/libinv'
+    >>> repository_full_name("gitorg/libinv")
+    'gitorg/libinv'
+    """
+    if repository.startswith(("git@", "https://")):
+        git_url = explode_git_url(repository)
+        repository = f"{git_url['org']}/{git_url['name']}"
+    return repository.casefold()
+
+
+def select_wasps(since=None, until=None, repositories=(), status="any"):
+    """
+    Return a query for (id, raw_message) of the latest matching wasp of each repository and commit
+    """
+    latest = select(func.max(Wasp.id)).select_from(Wasp)
+    if since:
+        latest = latest.where(Wasp.created_at >= since)
+    if until:
+        latest = latest.where(Wasp.created_at < until)
+    if status != "any":
+        latest = latest.where(Wasp.ate_successfully.is_(status == "succeeded"))
+    if repositories:
+        full_name = func.lower(Repository.org + "/" + Repository.name)
+        latest = latest.join(Repository, Repository.id == Wasp.repository_id).where(
+            full_name.in_(repositories)
+        )
+    latest = latest.group_by(Wasp.repository_id, Wasp.commit)
+    return select(Wasp.id, Wasp.raw_message).where(Wasp.id.in_(latest)).order_by(Wasp.id)
+
+
+@cli.command()
+@click.option("--days", type=click.INT, default=None, help="Wasps of the last these many days")
+@click.option("--since", type=click.DateTime(), default=None, help="Wasps created since")
+@click.option("--until", type=click.DateTime(), default=None, help="Wasps created before")
+@click.option(
+    "--repository",
+    "repositories",
+    multiple=True,
+    help="Only wasps of this repository, given as a git url or org/name. Can be repeated",
+)
+@click.option(
+    "--status",
+    type=click.Choice(["any", "failed", "succeeded"]),
+    default="any",
+    help="Only wasps that ate (un)successfully",
+)
+@click.option("--workers", type=click.INT, default=4, help="Number of worker processes")
+@click.option(
+    "--rate",
+    type=click.FLOAT,
+    default=0,
+    help="Scans started per minute at most, 0 for no limit",
+)
+@click.option("--dry-run", is_flag=True, default=False, help="Only count what would be scanned")
+def backfill(days, since, until, repositories, status, workers, rate, dry_run):
+    """
+    Scan again repositories of stored wasps, say, after cdxgen or semgrep rules improve.
+    Only the latest wasp of each repository and commit is scanned again.
+    """
+    if days:
+        since = max(since or datetime.min, datetime.now() - timedelta(days=days))
+    repositories = [repository_full_name(repository) for repository in repositories]
+
+    with Session() as session:
+        wasps = session.execute(select_wasps(since, until, repositories, status)).all()
+    click.echo(f"{len(wasps)} repository commits to scan again")
+    if dry_run or not wasps:
+        return
+
+    interval = 60 / rate if rate else 0
+    outcomes = Counter()
+    errors = []
+    in_flight = {}  # future: wasp id
+    executor = new_executor(workers)
+
+    with tqdm(total=len(wasps), unit="scan") as progress, logging_redirect_tqdm():
+
+        def record(wasp_id, acknowledged, error):
+            if error:
+                errors.append((wasp_id, error))
+                outcomes["failed"] += 1
+            else:
+                outcomes["scanned" if acknowledged else "incomplete"] += 1
+            progress.update()
+            progress.set_postfix(outcomes)
+
+        def replace_broken_executor():
+            """
+            A worker died (say, OOM killed) and took the pool with it, along with every scan in it
+            """
+            nonlocal executor
+            for wasp_id in in_flight.values():
+                record(wasp_id, False, "Worker pool broke while scanning, a worker died\n")
+            in_flight.clear()
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = new_executor(workers)
+
+        def collect(done):
+            for future in done:
+                if future not in in_flight:  # written off with a broken pool
+                    continue
+                try:
+                    acknowledged, error = future.result()
+                except BrokenProcessPool:
+                    replace_broken_executor()
+                    continue
+                except Exception:
+                    acknowledged, error = False, traceback.format_exc()
+                record(in_flight.pop(future), acknowledged, error)
+
+        def submit(raw_message):
+            try:
+                return executor.submit(backfill_message, raw_message)
+            except BrokenProcessPool:  # broke since the last collect
+                replace_broken_executor()
+                return executor.submit(backfill_message, raw_message)
+
+        try:
+            started_at = time.monotonic()
+            for submitted, (wasp_id, raw_message) in enumerate(wasps):
+                # Keep at most one scan per worker in flight so that the rate holds
+                while len(in_flight) >= workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                delay = started_at + submitted * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                in_flight[submit(raw_message)] = wasp_id
+
+            while in_flight:
+                collect(wait(in_flight).done)
+        finally:
+            executor.shutdown()
+
+    for wasp_id, error in errors:
+        click.echo(f"Backfill of wasp {wasp_id} failed:\n{error}", err=True)
+    click.echo(
+        f"Scanned {outcomes['scanned']} repository commits, {outcomes['incomplete']} incomplete,"
+        f" {outcomes['failed']} failed"
+    )
@@ -1,52 +1,129 @@
-import json
+import logging
 import traceback
 
 import click
 
-from libinv import poll
 from libinv import process_message
 from libinv.cli.cli import cli
-from libinv.helpers import send_to_slack
+from libinv.daemon import DUPLICATE
+from libinv.daemon import Admission
+from libinv.daemon import Coalescer
+from libinv.daemon import FailureHandler
+from libinv.daemon import Scheduler
+from libinv.daemon import Sharder
+from libinv.daemon import SlackReporter
+from libinv.daemon import WorkerPool
+from libinv.daemon import get_queue
+from libinv.env import ADMISSION_CONTROL
+from libinv.env import DAEMON_PREFETCH
+from libinv.env import DAEMON_SHARDING
+from libinv.env import DAEMON_WORKERS
+
+logger = logging.getLogger("libinv.daemon")
 
 
 @cli.command()
 @click.option("--slack/--no-slack", is_flag=True, default=True)
+@click.option(
+    "--workers",
+    type=click.INT,
+    default=DAEMON_WORKERS,
+    help="Number of worker processes. 0 processes messages one at a time in the daemon itself",
+)
+@click.option(
+    "--prefetch",
+    type=click.INT,
+    default=DAEMON_PREFETCH,
+    help="Number of messages to keep received beyond the ones being worked upon",
+)
+@click.option(
+    "--shard/--no-shard",
+    default=DAEMON_SHARDING,
+    help="Split messages among daemon nodes by repository, see DAEMON_NODE_NAME",
+)
 @click.pass_context
-def daemon(ctx, slack=True):
+def daemon(
+    ctx,
+    slack=True,
+    workers=DAEMON_WORKERS,
+    prefetch=DAEMON_PREFETCH,
+    shard=DAEMON_SHARDING,
+):
     """
-    Poll messages from sqs queue and populate libinv database
+    Poll messages from sqs (or the local queue, see QUEUE_BACKEND) and populate libinv database
     """
     click.echo("starting service")
     if not ctx.obj["slack_logging"]:
         click.echo("Overriding slack logs. Disabled")
         slack = False
+
+    reporter = None
+    if slack:
+        reporter = SlackReporter()
+        reporter.start()
+
+    consumer = get_queue()
+    sharder = None
+    if shard:
+        sharder = Sharder(consumer)
+        sharder.start()
+    failures = FailureHandler(consumer=consumer, reporter=reporter)
+    admission = Admission() if ADMISSION_CONTROL else None
+
+    try:
+        if workers:
+            click.echo(f"Starting {workers} workers")
+            pool = WorkerPool(
+                workers=workers,
+                prefetch=prefetch,
+                consumer=consumer,
+                failures=failures,
+                sharder=sharder,
+                admission=admission,
+            )
+            pool.run()
+        else:
+            consume(consumer, failures, sharder)
+    finally:
+        if sharder:
+            sharder.stop()
+
+
+def consume(consumer, failures, sharder=None):
+    """
+    Process messages one at a time, deleting each as soon as it is acknowledged so that it isn't
+    delivered again while the rest of its batch is processed
+    """
+    coalescer = Coalescer()
+    scheduler = Scheduler()
     while True:
         click.echo("polling for new messages")
-        messages = poll()
+        messages = consumer.poll()
+        if sharder:
+            messages = sharder.split(messages)
         for message in messages:
-            try:
-                process_message(message)
-            except Exception:
-                if not slack:
-                    raise
-
-                txt = ":alert: *Error while handling message:*\n"
-                txt += "```"
-                txt += json.dumps(message)
-                txt += "```\n"
-                send_to_slack(txt)
-                trace = traceback.format_exc()
-                chunk_size = 3900
-                txt = "*Stack trace:*\n"
-                txt += "```"
-                txt += trace[0:chunk_size]
-                txt += "```"
-                send_to_slack(txt)
-                if trace:
-                    for start in range(chunk_size, len(trace), chunk_size):
-                        txt = "```"
-                        txt += trace[start : start + chunk_size]
-                        txt += "```"
-                        send_to_slack(txt)
-                click.echo("Error sent to slack. Exiting")
-                return
+            scheduler.add(message)
+        while scheduler:
+            message = scheduler.next()
+            if coalescer.admit(message) == DUPLICATE:
+                delete_acknowledged(consumer, [message])
+                continue
+
+            if failures.exhausted(message):
+                failures.quarantine(message, "Never finished processing")
+                acknowledge = True
+            else:
+                try:
+                    acknowledge = process_message(message)
+                except Exception as exc:
+                    click.echo("Error while handling message")
+                    acknowledge = failures.handle(message, exc, traceback.format_exc())
+
+            attached = coalescer.finish(message, acknowledge)
+            if acknowledge:
+                delete_acknowledged(consumer, [message, *attached])
+
+
+def delete_acknowledged(consumer, messages):
+    for failure in consumer.delete([message["ReceiptHandle"] for message in messages]):
+        logger.error(f"Could not delete message: {failure}")
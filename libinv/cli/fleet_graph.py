@@ -0,0 +1,45 @@
+import click
+
+from libinv import Session
+from libinv.blast_radius.fleet_graph import load_fleet_graph
+from libinv.blast_radius.fleet_graph import update_fleet_graph
+from libinv.cli.cli import cli
+from libinv.env import FLEET_GRAPH_PATH
+
+
+@cli.group()
+def fleet_graph():
+    """
+    The dependency graph of every project merged into one
+    """
+    pass
+
+
+@fleet_graph.command()
+@click.option("--full", is_flag=True, help="Rebuild the graph from every uploaded sbom")
+@click.option("--path", default=FLEET_GRAPH_PATH, show_default=True)
+def update(full, path):
+    """
+    Merge sboms uploaded since the last update into the fleet graph, meant to be run by cron
+    """
+    with Session() as session:
+        fleet = update_fleet_graph(session, path, full=full)
+    click.echo(
+        f"{len(fleet.projects)} projects, {len(fleet)} packages, {fleet.number_of_edges()} edges"
+    )
+
+
+@fleet_graph.command()
+@click.option("--path", default=FLEET_GRAPH_PATH, show_default=True)
+@click.argument("package")
+def affected(path, package):
+    """
+    List projects that pull in a package, a purl or one without a version for any version
+    """
+    try:
+        found = load_fleet_graph(path).affected(package)
+    except FileNotFoundError:
+        raise click.ClickException(f"No fleet graph at {path}, run libinv fleet-graph update")
+    click.echo(f"Projects ({len(found)}):")
+    for name, project in found.items():
+        click.echo(f"  {name}\t{' -> '.join(project['path'])}")
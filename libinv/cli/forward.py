@@ -0,0 +1,22 @@
+import click
+
+from libinv.cli.cli import cli
+from libinv.job_queue import JobQueue
+from libinv.job_queue import forward as forward_batch
+from libinv.sqs import get_consumer
+
+
+@cli.command()
+@click.option("--once", is_flag=True, help="Stop once the sqs queue is empty")
+def forward(once):
+    """
+    Move messages from sqs into the scan_jobs table, for daemons run with QUEUE_BACKEND=postgres
+    """
+    source, queue = get_consumer(), JobQueue()
+    while True:
+        # a short poll is enough to tell that the queue is empty
+        forwarded = forward_batch(source, queue, wait_time=1 if once else 20)
+        if forwarded:
+            click.echo(f"Forwarded {forwarded} messages")
+        elif once:
+            return
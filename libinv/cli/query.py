@@ -4,6 +4,7 @@ from libinv import Session
 from libinv.cli.cli import cli
 from libinv.models import Image
 from libinv.models import get_base_image_of
+from libinv.package_index import find_package
 
 
 @cli.group()
@@ -33,3 +34,32 @@ def sbom(tech_only, sre_only, image_id):
         click.echo(list(map(lambda x: (x.package_id), sre_packages)))
     else:
         click.echo(list(map(lambda x: (x.package_id), all_packages)))
+
+
+@query.command()
+@click.option(
+    "--version",
+    "specifier",
+    default="",
+    help="Only versions matching this specifier, like '<2.17' or '>=2.0,<2.17'",
+)
+@click.option("--deployed", is_flag=True, help="Only images that are currently deployed")
+@click.argument("name")
+def package(specifier, deployed, name):
+    """
+    Find repositories and images that have a package, say, during an incident
+    """
+    with Session() as session:
+        try:
+            found = find_package(session, name, specifier, deployed_only=deployed)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--version")
+
+    click.echo(f"Repositories ({len(found['repositories'])}):")
+    for repository in found["repositories"]:
+        click.echo(f"  {repository['repository']}\t{repository['version']}\t{repository['purl']}")
+    click.echo(f"Images ({len(found['images'])}):")
+    for image in found["images"]:
+        click.echo(
+            f"  {image['image']}:{image['tag']} ({image['id']})\t{image['version']}\t{image['purl']}"
+        )
@@ -0,0 +1,64 @@
+import time
+
+import click
+
+from libinv import Session
+from libinv.cli.cli import cli
+from libinv.env import LOCAL_QUEUE_PATH
+from libinv.job_queue import JobQueue
+from libinv.local_queue import LocalQueue
+from libinv.models import Wasp
+
+
+@cli.command()
+@click.option(
+    "--rate",
+    type=click.FLOAT,
+    default=1.0,
+    help="Messages sent per second, 0 sends them all at once",
+)
+@click.option("--since", type=click.DateTime(), default=None, help="Replay wasps created since")
+@click.option("--until", type=click.DateTime(), default=None, help="Replay wasps created before")
+@click.option("--limit", type=click.INT, default=None, help="Replay at most these many messages")
+@click.option(
+    "--queue",
+    "queue_path",
+    type=click.Path(dir_okay=False),
+    default=LOCAL_QUEUE_PATH,
+    help="Local queue file to load messages into",
+)
+@click.option(
+    "--to",
+    "backend",
+    type=click.Choice(["local", "postgres"]),
+    default="local",
+    help="Load messages into the local queue file or the scan_jobs table",
+)
+def replay(rate, since, until, limit, queue_path, backend):
+    """
+    Load messages eaten by past wasps, oldest first, into the local queue (or scan jobs table).
+    Run the daemon with QUEUE_BACKEND=local (or postgres) to process them.
+    """
+    queue = LocalQueue(queue_path) if backend == "local" else JobQueue()
+    interval = 1 / rate if rate else 0
+
+    with Session() as session:
+        query = session.query(Wasp.raw_message).order_by(Wasp.id)
+        if since:
+            query = query.filter(Wasp.created_at >= since)
+        if until:
+            query = query.filter(Wasp.created_at < until)
+        if limit:
+            query = query.limit(limit)
+
+        started_at = time.monotonic()
+        sent = 0
+        for (raw_message,) in query.yield_per(100):
+            # Keep to the rate overall rather than sleeping a fixed interval after every send
+            delay = started_at + sent * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            queue.send(raw_message)
+            sent += 1
+
+    click.echo(f"Replayed {sent} messages into {backend} queue, {len(queue)} messages queued")
@@ -1,3 +1,4 @@
+import json
 from pathlib import Path
 
 from libinv.env import CRANE_BIN
@@ -28,3 +29,9 @@ def digest(image: str, platform: str, insecure=False):
             [CRANE_BIN, "digest", "--insecure", "--platform", platform, image],
         ).stdout.strip()
     return subprocess_run([CRANE_BIN, "digest", "--platform", platform, image]).stdout.strip()
+
+
+def manifest(image: str, insecure=False) -> dict:
+    if insecure:
+        return json.loads(subprocess_run([CRANE_BIN, "manifest", "--insecure", image]).stdout)
+    return json.loads(subprocess_run([CRANE_BIN, "manifest", image]).stdout)
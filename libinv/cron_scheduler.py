@@ -27,6 +27,11 @@ JOBS = {
         "timeout": 600,
         "interval": 300,
     },
+    "update_fleet_graph": {
+        "command": "libinv --debug fleet-graph update",
+        "timeout": 1800,
+        "interval": 900,
+    },
 }
 
 
@@ -0,0 +1,13 @@
+from libinv.daemon.admission import Admission
+from libinv.daemon.backends import get_queue
+from libinv.daemon.coalesce import ATTACHED
+from libinv.daemon.coalesce import DUPLICATE
+from libinv.daemon.coalesce import RUN
+from libinv.daemon.coalesce import Coalescer
+from libinv.daemon.failures import FailureHandler
+from libinv.daemon.pool import WorkerPool
+from libinv.daemon.reporting import SlackReporter
+from libinv.daemon.reporting import report_to_slack
+from libinv.daemon.scheduler import Scheduler
+from libinv.daemon.sharding import HashRing
+from libinv.daemon.sharding import Sharder
@@ -0,0 +1,172 @@
+import json
+import logging
+import shutil
+from pathlib import Path
+
+from sqlalchemy import select
+
+from libinv import crane
+from libinv.base import Session
+from libinv.daemon.scheduler import ttl_cache
+from libinv.env import ADMISSION_DEFAULT_FOOTPRINT
+from libinv.env import ADMISSION_DISK_HEADROOM
+from libinv.env import ADMISSION_MEMORY_PER_SCAN
+from libinv.env import AWS_REGION
+from libinv.env import LIBINV_TEMP_DIR
+from libinv.helpers import explode_git_url
+from libinv.models import Repository
+from libinv.models import Wasp
+
+logger = logging.getLogger("libinv.daemon")
+
+RECENT_WASPS = 5  # scans of a repository to look at for its footprint
+IMAGE_EXPANSION = 3  # an image on disk (tarball, extracted sbom...) over its compressed layers
+MAX_PLATFORMS = 2  # platforms of an image index that are pulled
+
+
+def available_memory():
+    """
+    Return bytes of memory available for new work, None if it can't be told
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def ecr_image(message: dict):
+    """
+    Return (repository, reference) of the image of an ecr message, None for other messages
+
+    >>> detail = {"repository-name": "web", "image-digest": "sha256:f", "image-tag": "v1"}
+    >>> ecr_image({"account": "1234", "region": "ap-south-1", "detail": detail})
+    ('1234.dkr.ecr.ap-south-1.amazonaws.com/web', '@sha256:f')
+    >>> ecr_image({"type": "bridge"}) is None
+    True
+    """
+    detail = message.get("detail")
+    if message.get("type") or not detail or not detail.get("repository-name"):
+        return None
+    region = message.get("region") or AWS_REGION
+    registry = f"{message.get('account')}.dkr.ecr.{region}.amazonaws.com"
+    repository = f"{registry}/{detail['repository-name']}"
+    if detail.get("image-digest"):
+        return repository, f"@{detail['image-digest']}"
+    return repository, f":{detail.get('image-tag') or 'latest'}"
+
+
+class Admission:
+    """
+    Hold back new scans till there is room for them on disk and in memory, so that a burst of
+    large images doesn't fill up ``LIBINV_TEMP_DIR`` and fail everything on it halfway.
+
+    A scan's footprint is estimated from its image's layer sizes in the registry manifest, or from
+    what recent scans of its repository took. A scan is admitted if free disk, less footprints of
+    scans in flight (some of which is already used, so this errs on the safe side), leaves room
+    for it and ``headroom`` more, and available memory, less ``memory_per_scan`` for each scan in
+    flight, leaves ``memory_per_scan`` for it. A scan is always admitted when nothing else is in
+    flight, so that work never stops altogether.
+    """
+
+    def __init__(
+        self,
+        directory=LIBINV_TEMP_DIR,
+        headroom=ADMISSION_DISK_HEADROOM,
+        default_footprint=ADMISSION_DEFAULT_FOOTPRINT,
+        memory_per_scan=ADMISSION_MEMORY_PER_SCAN,
+    ):
+        self.directory = Path(directory)
+        self.headroom = headroom
+        self.default_footprint = default_footprint
+        self.memory_per_scan = memory_per_scan
+        self.cache = {}
+        self.holding = False
+
+    def footprint(self, message_metadata: dict) -> int:
+        try:
+            message = json.loads(message_metadata["Body"])
+            if not isinstance(message, dict):
+                return self.default_footprint
+            if message.get("type", "").casefold() == "bridge":
+                return self.repository_footprint(message["repository"]["url"])
+            image = ecr_image(message)
+            if image:
+                return self.image_footprint(*image)
+        except Exception:  # an estimate is not worth failing over
+            logger.exception("Could not estimate footprint of message")
+        return self.default_footprint
+
+    @ttl_cache()
+    def repository_footprint(self, repository_url: str) -> int:
+        git_url = explode_git_url(repository_url)
+        with Session() as session:
+            footprints = session.scalars(
+                select(Wasp.footprint)
+                .join(Repository, Repository.id == Wasp.repository_id)
+                .where(
+                    Repository.org == git_url["org"],
+                    Repository.name == git_url["name"],
+                    Wasp.footprint.is_not(None),
+                )
+                .order_by(Wasp.id.desc())
+                .limit(RECENT_WASPS)
+            ).all()
+        return max(footprints, default=self.default_footprint)
+
+    @ttl_cache()
+    def image_footprint(self, repository: str, reference: str) -> int:
+        try:
+            manifest = crane.manifest(f"{repository}{reference}")
+            manifests = [manifest]
+            if "manifests" in manifest:  # an image index, each platform is pulled
+                manifests = [
+                    crane.manifest(f"{repository}@{platform['digest']}")
+                    for platform in manifest["manifests"][:MAX_PLATFORMS]
+                ]
+        except Exception:  # remember the default rather than asking the registry every time
+            logger.exception(f"Could not get manifest of {repository}{reference}")
+            return self.default_footprint
+
+        size = sum(
+            layer.get("size", 0) for manifest in manifests for layer in manifest.get("layers", [])
+        )
+        return size * IMAGE_EXPANSION or self.default_footprint
+
+    def free_disk(self) -> int:
+        self.directory.mkdir(exist_ok=True, parents=True)
+        return shutil.disk_usage(self.directory).free
+
+    def admits(self, message: dict, in_flight: list) -> bool:
+        if not in_flight:
+            return self.hold(False)
+
+        footprint = self.footprint(message)
+        reserved = sum(self.footprint(other) for other in in_flight)
+        free = self.free_disk() - reserved
+        if free < footprint + self.headroom:
+            return self.hold(True, f"{footprint} bytes needed, {free} bytes free on disk")
+
+        memory = available_memory()
+        if memory is not None:
+            # scans in flight may not have grown yet, so they are reserved for as on disk
+            free = memory - self.memory_per_scan * len(in_flight)
+            if free < self.memory_per_scan:
+                return self.hold(
+                    True, f"{self.memory_per_scan} bytes needed, {free} bytes free in memory"
+                )
+        return self.hold(False)
+
+    def hold(self, holding: bool, reason: str = None) -> bool:
+        """
+        Return whether a scan is admitted, logging only when that changes
+        """
+        if holding and not self.holding:
+            logger.warning(f"Holding back new scans till resources are free: {reason}")
+        elif not holding and self.holding:
+            logger.info("Resuming new scans")
+        self.holding = holding
+        return not holding
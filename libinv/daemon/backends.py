@@ -0,0 +1,25 @@
+from functools import lru_cache
+
+from libinv.env import QUEUE_BACKEND
+from libinv.job_queue import JobQueue
+from libinv.local_queue import LocalQueue
+from libinv.sqs import get_consumer
+
+BACKENDS = {
+    "sqs": get_consumer,
+    "local": LocalQueue,
+    "postgres": JobQueue,
+}
+
+
+@lru_cache(maxsize=None)
+def get_queue():
+    """
+    Return a consumer of the queue the daemon listens on, as per QUEUE_BACKEND
+    """
+    backend = QUEUE_BACKEND.casefold()
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown QUEUE_BACKEND: {QUEUE_BACKEND}, expected one of {list(BACKENDS)}"
+        )
+    return BACKENDS[backend]()
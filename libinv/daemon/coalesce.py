@@ -0,0 +1,123 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from libinv.env import DEDUP_WINDOW
+
+logger = logging.getLogger("libinv.daemon")
+
+RUN = "run"
+ATTACHED = "attached"
+DUPLICATE = "duplicate"
+
+
+def coalesce_key(message_metadata: dict):
+    """
+    Return a key that is the same for messages asking for the same scan, None if the message
+    can't be coalesced
+
+    >>> bridge = {
+    ...     "type": "bridge",
+    ...     "repository": {"url": "git@github.com:gitorg/libinv.git", "commit": "abc", "tag": "t1"},
+    ...     "aws_environment": "prod",
+    ... }
+    >>> coalesce_key({"Body": json.dumps(bridge)})
+    ('bridge', 'git@github.com:gitorg/libinv.git', 'abc', 'prod')
+    >>> ecr = {"account": "1234", "detail": {"repository-name": "web", "image-digest": "sha256:f"}}
+    >>> coalesce_key({"Body": json.dumps(ecr)})
+    ('ecr', '1234', 'web', 'sha256:f')
+    >>> coalesce_key({"Body": "{bad"}) is None
+    True
+    """
+    try:
+        message = json.loads(message_metadata["Body"])
+    except (json.JSONDecodeError, TypeError, KeyError):
+        return None
+
+    if not isinstance(message, dict):
+        return None
+
+    message_type = message.get("type", "").casefold()
+    if message_type == "bridge":
+        repository = message.get("repository") or {}
+        # Environment is part of the key: vulnerable paths are kept per environment
+        return (
+            "bridge",
+            repository.get("url"),
+            repository.get("commit"),
+            message.get("aws_environment"),
+        )
+
+    detail = message.get("detail")
+    if not message_type and detail:
+        return (
+            "ecr",
+            message.get("account"),
+            detail.get("repository-name"),
+            detail.get("image-digest") or detail.get("image-tag"),
+        )
+    return None
+
+
+class Coalescer:
+    """
+    Stop duplicate messages (retried jenkins jobs, multi tag pushes...) from scanning the same
+    thing again.
+
+    A duplicate of a message that is being processed is held and acknowledged along with it, a
+    duplicate of a message that was processed less than ``window`` seconds ago is acknowledged
+    straight away.
+    """
+
+    def __init__(self, window=DEDUP_WINDOW):
+        self.window = window
+        self.in_flight = {}  # key: [attached messages]
+        self.completed = OrderedDict()  # key: completion time
+
+    def admit(self, message: dict) -> str:
+        """
+        Return RUN if the message should be processed, ATTACHED if it is now held till an in-flight
+        duplicate is done and DUPLICATE if it can be acknowledged without processing
+        """
+        key = coalesce_key(message)
+        if key is None or not self.window:
+            return RUN
+
+        self.expire()
+        if key in self.in_flight:
+            self.in_flight[key].append(message)
+            logger.info(f"Attached duplicate message {message.get('MessageId')} to {key}")
+            return ATTACHED
+        if key in self.completed:
+            logger.info(f"Skipped duplicate message {message.get('MessageId')} of {key}")
+            return DUPLICATE
+
+        self.in_flight[key] = []
+        return RUN
+
+    def finish(self, message: dict, acknowledged: bool) -> list:
+        """
+        Return messages that were attached to the given message. They share its outcome: if it is
+        not acknowledged, neither are they and the queue delivers them again.
+        """
+        key = coalesce_key(message)
+        if key is None or key not in self.in_flight:
+            return []
+
+        attached = self.in_flight.pop(key)
+        if acknowledged:
+            self.completed[key] = time.monotonic()
+            self.completed.move_to_end(key)
+        return attached
+
+    def attached(self) -> list:
+        return [message for messages in self.in_flight.values() for message in messages]
+
+    def expire(self):
+        deadline = time.monotonic() - self.window
+        while self.completed:
+            key, completed_at = next(iter(self.completed.items()))
+            if completed_at > deadline:
+                break
+            self.completed.popitem(last=False)
@@ -0,0 +1,103 @@
+import json
+import logging
+from pathlib import Path
+
+from libinv.base import Session
+from libinv.env import LIBINV_TEMP_DIR
+from libinv.env import MESSAGE_MAX_ATTEMPTS
+from libinv.env import MESSAGE_RETRY_BACKOFF
+from libinv.exceptions import MalformedCaterpillarMessage
+from libinv.models import QuarantinedMessage
+from libinv.sqs import attempt_count
+
+logger = logging.getLogger("libinv.daemon")
+
+# Retrying won't help with these, the message itself is bad
+PERMANENT_ERRORS = (json.JSONDecodeError, MalformedCaterpillarMessage)
+
+MAX_VISIBILITY_TIMEOUT = 12 * 60 * 60  # sqs does not allow hiding a message for longer
+DEAD_LETTER_FILE = Path(LIBINV_TEMP_DIR, "dead-letters.jsonl")
+
+
+class FailureHandler:
+    """
+    Decide what happens to a message that could not be processed.
+
+    A failed message is retried ``max_attempts`` times by letting the queue deliver it again, each
+    time after twice as long as the last. After that, or straight away if the message is malformed,
+    it is quarantined in the database and acknowledged so that the daemon keeps consuming.
+
+    Deliveries that only put a message back for another node (see sharding) are not attempts.
+    """
+
+    def __init__(
+        self,
+        consumer,
+        reporter=None,
+        max_attempts=MESSAGE_MAX_ATTEMPTS,
+        backoff=MESSAGE_RETRY_BACKOFF,
+    ):
+        self.consumer = consumer
+        self.reporter = reporter
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def attempts(self, message: dict) -> int:
+        return attempt_count(message)
+
+    def exhausted(self, message: dict) -> bool:
+        """
+        Return True if a message was already delivered ``max_attempts`` times without being
+        acknowledged, say, because it took down its worker each time
+        """
+        return self.attempts(message) > self.max_attempts
+
+    def handle(self, message: dict, exc: Exception, trace: str) -> bool:
+        """
+        Return True if the message should be acknowledged
+        """
+        if self.reporter:
+            self.reporter.report(message, trace)
+
+        attempts = self.attempts(message)
+        if isinstance(exc, PERMANENT_ERRORS) or attempts >= self.max_attempts:
+            self.quarantine(message, trace, attempts)
+            return True
+
+        delay = min(self.backoff * 2 ** (attempts - 1), MAX_VISIBILITY_TIMEOUT)
+        try:
+            self.consumer.change_visibility([message["ReceiptHandle"]], delay)
+        except Exception:
+            logger.exception("Could not delay retry of message")
+        logger.warning(
+            f"Message {message.get('MessageId')} failed on attempt {attempts}/{self.max_attempts},"
+            f" retrying in {delay} seconds"
+        )
+        return False
+
+    def quarantine(self, message: dict, error: str, attempts: int = None):
+        if attempts is None:
+            attempts = self.attempts(message)
+        try:
+            with Session() as session:
+                session.add(
+                    QuarantinedMessage(
+                        message_id=message.get("MessageId"),
+                        body=message["Body"],
+                        attempts=attempts,
+                        error=error,
+                    )
+                )
+                session.commit()
+        except Exception:
+            logger.exception(f"Could not quarantine message in db, writing to {DEAD_LETTER_FILE}")
+            DEAD_LETTER_FILE.parent.mkdir(exist_ok=True, parents=True)
+            with open(DEAD_LETTER_FILE, "a") as dead_letters:
+                entry = {
+                    "message_id": message.get("MessageId"),
+                    "body": message["Body"],
+                    "attempts": attempts,
+                    "error": error,
+                }
+                dead_letters.write(json.dumps(entry) + "\n")
+        logger.error(f"Quarantined message {message.get('MessageId')} after {attempts} attempts")
@@ -0,0 +1,266 @@
+import logging
+import multiprocessing
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+
+from libinv.base import engine
+from libinv.daemon.backends import get_queue
+from libinv.daemon.coalesce import ATTACHED
+from libinv.daemon.coalesce import DUPLICATE
+from libinv.daemon.coalesce import RUN
+from libinv.daemon.coalesce import Coalescer
+from libinv.daemon.scheduler import Scheduler
+from libinv.env import DAEMON_PREFETCH
+from libinv.env import SQS_HEARTBEAT_INTERVAL
+from libinv.env import SQS_VISIBILITY_TIMEOUT
+from libinv.main import process_message
+from libinv.sqs import get_consumer
+
+logger = logging.getLogger("libinv.daemon")
+
+REAP_TIMEOUT = 5  # seconds to wait for a worker to finish before polling again
+
+# Workers are forked from a clean server process rather than from the daemon, whose heartbeat,
+# sharder and reporter threads may hold locks (or half built clients) at the time
+WORKER_CONTEXT = multiprocessing.get_context("forkserver")
+WORKER_CONTEXT.set_forkserver_preload(["libinv.main"])
+
+
+def init_worker():
+    # Never share pooled db or HTTP connections with the parent process
+    engine.dispose(close=False)
+    get_consumer.cache_clear()
+    get_queue.cache_clear()
+
+
+class Heartbeat(threading.Thread):
+    """
+    Keep extending visibility of messages held by a pool so that sqs does not hand them out
+    again while they are waiting or being worked upon
+    """
+
+    def __init__(self, pool, interval=SQS_HEARTBEAT_INTERVAL, timeout=SQS_VISIBILITY_TIMEOUT):
+        super().__init__(name="sqs-heartbeat", daemon=True)
+        self.pool = pool
+        self.consumer = pool.consumer
+        self.interval = interval
+        self.timeout = timeout
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            receipt_handles = self.pool.receipt_handles()
+            if not receipt_handles:
+                continue
+            try:
+                failed = self.consumer.change_visibility(receipt_handles, self.timeout)
+            except Exception:
+                logger.exception("Could not extend visibility of in-flight messages")
+                continue
+            for failure in failed:
+                logger.warning(f"Could not extend visibility: {failure}")
+            logger.debug(f"Extended visibility of {len(receipt_handles)} messages")
+
+    def stop(self):
+        self.stopped.set()
+
+
+class WorkerPool:
+    """
+    Process queue messages with a pool of worker processes.
+
+    Up to ``workers`` messages are processed at a time and up to ``prefetch`` more are kept
+    received so that a free worker never waits on a long poll. Received messages wait in a
+    scheduler that decides which one runs next, and if given, in admission till there are
+    resources for them. A message is deleted only after its worker is done with it.
+    """
+
+    def __init__(
+        self,
+        workers,
+        prefetch=DAEMON_PREFETCH,
+        consumer=None,
+        failures=None,
+        coalescer=None,
+        scheduler=None,
+        sharder=None,
+        admission=None,
+    ):
+        self.workers = workers
+        self.prefetch = prefetch
+        self.consumer = consumer or get_queue()
+        self.failures = failures
+        self.coalescer = coalescer or Coalescer()
+        self.pending = Scheduler() if scheduler is None else scheduler  # empty one is falsy
+        self.sharder = sharder
+        self.admission = admission
+        self.in_flight = {}  # future: message
+        self.acknowledged = []  # receipt handles to be deleted
+        self.lock = threading.Lock()
+        self.stopping = False
+        self.executor = self.new_executor()
+        self.heartbeat = Heartbeat(self)
+
+    def new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=WORKER_CONTEXT, initializer=init_worker
+        )
+
+    def receipt_handles(self):
+        with self.lock:
+            messages = [*self.pending, *self.in_flight.values(), *self.coalescer.attached()]
+        return [message["ReceiptHandle"] for message in messages]
+
+    @property
+    def capacity(self):
+        return self.workers + self.prefetch - len(self.pending) - len(self.in_flight)
+
+    @property
+    def busy(self):
+        return bool(self.pending or self.in_flight)
+
+    def fill(self):
+        capacity = self.capacity
+        if capacity <= 0:
+            return
+
+        # Long poll only when there is nothing else to look after
+        wait_time = 1 if self.busy else 20
+        messages = self.consumer.receive(count=min(capacity, 10), wait_time=wait_time)
+        if messages:
+            logger.debug(f"Received {len(messages)} messages")
+        if self.sharder:
+            messages = self.sharder.split(messages)
+        for message in messages:
+            self.pending.add(message)  # outside the lock, it may hit the db
+
+    def dispatch(self):
+        while self.pending and len(self.in_flight) < self.workers:
+            if not self.admitted():
+                return  # till something in flight is done
+            self.start_next()
+
+    def admitted(self) -> bool:
+        """
+        Return whether the next pending message may start: its repository is not busy and
+        admission, if any, has room for it
+        """
+        with self.lock:
+            message = self.pending.peek()
+        if message is None:  # everything waiting belongs to busy repositories
+            return False
+        return not self.admission or self.admission.admits(message, list(self.in_flight.values()))
+
+    def start_next(self):
+        with self.lock:
+            message = self.pending.next()
+            verdict = self.coalescer.admit(message)
+            if verdict == RUN:
+                self.pending.started(message)
+
+        if verdict == DUPLICATE:
+            self.acknowledged.append(message["ReceiptHandle"])
+            return
+        if verdict == ATTACHED:
+            return
+        if self.failures and self.failures.exhausted(message):
+            self.failures.quarantine(message, "Never finished processing")
+            self.complete(message, acknowledge=True)
+            return
+
+        try:
+            future = self.submit(message)
+        except BrokenProcessPool:  # a worker died since the last reap
+            self.replace_broken_executor(message)
+            return
+        with self.lock:
+            self.in_flight[future] = message
+
+    def submit(self, message):
+        return self.executor.submit(process_message, message)
+
+    def reap(self, timeout=REAP_TIMEOUT):
+        if not self.in_flight:
+            return
+
+        done, _ = wait(list(self.in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        self.collect(done)
+
+    def collect(self, done):
+        for future in done:
+            with self.lock:
+                message = self.in_flight.pop(future, None)
+            if message is None:  # already written off with a broken pool
+                continue
+
+            try:
+                acknowledge = future.result()
+            except BrokenProcessPool:
+                self.replace_broken_executor(message)
+                continue
+            except Exception as exc:
+                trace = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+                logger.error(f"Error while handling message: {message}\n{trace}")
+                acknowledge = bool(self.failures and self.failures.handle(message, exc, trace))
+
+            self.complete(message, acknowledge)
+
+    def complete(self, message, acknowledge):
+        """
+        Acknowledge a message, and its duplicates, if its work is done
+        """
+        with self.lock:
+            attached = self.coalescer.finish(message, acknowledge)
+            self.pending.finished(message)
+        if acknowledge:
+            self.acknowledged.extend(m["ReceiptHandle"] for m in [message, *attached])
+
+    def flush_acknowledged(self):
+        """
+        Delete all acknowledged messages, batched
+        """
+        if not self.acknowledged:
+            return
+        receipt_handles, self.acknowledged = self.acknowledged, []
+        for failure in self.consumer.delete(receipt_handles):
+            logger.error(f"Could not delete message: {failure}")
+
+    def replace_broken_executor(self, message):
+        """
+        A worker died (say, OOM killed). Every message in the pool is lost with it and will be
+        delivered again by sqs once its visibility runs out.
+        """
+        with self.lock:
+            lost = [message, *self.in_flight.values()]
+            self.in_flight.clear()
+        logger.error(f"Worker pool broke, {len(lost)} in-flight messages will be redelivered")
+        for lost_message in lost:
+            self.complete(lost_message, acknowledge=False)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self.new_executor()
+
+    def stop(self):
+        """
+        Stop receiving new messages, let the in-flight ones finish
+        """
+        self.stopping = True
+        with self.lock:
+            self.pending.clear()
+
+    def run(self):
+        self.heartbeat.start()
+        try:
+            while not (self.stopping and not self.in_flight):
+                if not self.stopping:
+                    self.fill()
+                    self.dispatch()
+                self.reap()
+                self.flush_acknowledged()
+        finally:
+            self.heartbeat.stop()
+            self.executor.shutdown()
+            self.flush_acknowledged()
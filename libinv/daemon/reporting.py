@@ -0,0 +1,101 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from libinv.env import SLACK_MAX_REPORTS
+from libinv.env import SLACK_REPORT_PERIOD
+from libinv.helpers import send_to_slack
+
+logger = logging.getLogger("libinv.daemon")
+
+SLACK_CHUNK_SIZE = 3900
+
+
+def report_to_slack(message: dict, trace: str):
+    """
+    Send a failed message and its stack trace to slack, chunked to fit slack's limits
+    """
+    txt = ":alert: *Error while handling message:*\n"
+    txt += "```"
+    txt += json.dumps(message)
+    txt += "```\n"
+    send_to_slack(txt)
+    txt = "*Stack trace:*\n"
+    txt += "```"
+    txt += trace[0:SLACK_CHUNK_SIZE]
+    txt += "```"
+    send_to_slack(txt)
+    if trace:
+        for start in range(SLACK_CHUNK_SIZE, len(trace), SLACK_CHUNK_SIZE):
+            txt = "```"
+            txt += trace[start : start + SLACK_CHUNK_SIZE]
+            txt += "```"
+            send_to_slack(txt)
+
+
+class SlackReporter(threading.Thread):
+    """
+    Report failed messages to slack from a background thread.
+    At most ``max_reports`` failures are sent every ``period`` seconds, the rest are only counted
+    and summarized so that a burst of failures neither floods slack nor slows down the daemon.
+    """
+
+    def __init__(self, max_reports=SLACK_MAX_REPORTS, period=SLACK_REPORT_PERIOD):
+        super().__init__(name="slack-reporter", daemon=True)
+        self.max_reports = max_reports
+        self.period = period
+        self.reports = queue.Queue(maxsize=100)
+        self.sent = 0
+        self.suppressed = 0
+        self.window_start = time.monotonic()
+        self.lock = threading.Lock()  # counters are changed by reporting threads and this one
+
+    def report(self, message: dict, trace: str):
+        try:
+            self.reports.put_nowait((message, trace))
+        except queue.Full:
+            with self.lock:
+                self.suppressed += 1
+
+    def run(self):
+        while True:
+            try:
+                message, trace = self.reports.get(timeout=self.period)
+            except queue.Empty:
+                message = None
+
+            if time.monotonic() - self.window_start >= self.period:
+                self.start_window()
+
+            if message is None:
+                continue
+            with self.lock:
+                over_limit = self.sent >= self.max_reports
+                if over_limit:
+                    self.suppressed += 1
+                else:
+                    self.sent += 1
+            if over_limit:
+                continue
+
+            try:
+                report_to_slack(message, trace)
+            except Exception:
+                logger.exception("Could not report error to slack")
+
+    def start_window(self):
+        with self.lock:
+            suppressed = self.suppressed
+            self.sent = 0
+            self.suppressed = 0
+            self.window_start = time.monotonic()
+        if suppressed:
+            try:
+                send_to_slack(
+                    f":warning: {suppressed} more errors while handling messages were not "
+                    "reported. See daemon logs."
+                )
+            except Exception:
+                logger.exception("Could not report error to slack")
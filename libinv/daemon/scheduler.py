@@ -0,0 +1,211 @@
+import json
+import logging
+import time
+from collections import Counter
+from functools import wraps
+
+from libinv.base import Session
+from libinv.env import DAEMON_MAX_PER_REPOSITORY
+from libinv.env import SCHEDULER_DEPLOYED_BOOST
+from libinv.env import SCHEDULER_PROD_BOOST
+from libinv.helpers import explode_git_url
+from libinv.models import Account
+from libinv.models import Image
+from libinv.models import LatestImage
+from libinv.models import Repository
+
+logger = logging.getLogger("libinv.daemon")
+
+LOOKUP_TTL = 600  # seconds to remember an account type or deployment status
+
+
+def describe(message_metadata: dict):
+    """
+    Return (repository key, account ids, environment) of a message as far as scheduling is
+    concerned
+
+    >>> bridge = {
+    ...     "type": "bridge",
+    ...     "repository": {"url": "git@github.com:gitorg/libinv.git", "commit": "abc"},
+    ...     "aws_environment": "prod",
+    ...     "ecr_image": [{"name": "1234.dkr.ecr.ap-south-1.amazonaws.com/libinv"}],
+    ... }
+    >>> describe({"Body": json.dumps(bridge)})
+    ('git@github.com:gitorg/libinv.git', ('1234',), 'prod')
+    >>> describe({"Body": json.dumps({"account": "1234", "detail": {"repository-name": "web"}})})
+    ('web', ('1234',), None)
+    """
+    try:
+        message = json.loads(message_metadata["Body"])
+    except (json.JSONDecodeError, TypeError, KeyError):
+        return None, (), None
+    if not isinstance(message, dict):
+        return None, (), None
+
+    if message.get("type", "").casefold() == "bridge":
+        repository = (message.get("repository") or {}).get("url")
+        accounts = tuple(
+            image["name"].partition(".")[0]
+            for image in message.get("ecr_image") or []
+            if image.get("name")
+        )
+        return repository, accounts, message.get("aws_environment")
+
+    repository = (message.get("detail") or {}).get("repository-name")
+    account = message.get("account")
+    return repository, (account,) if account else (), None
+
+
+def ttl_cache(ttl=LOOKUP_TTL):
+    """
+    Cache results of a method for ``ttl`` seconds, keyed by its arguments
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args):
+            key = (func.__name__, *args)
+            cached = self.cache.get(key)
+            if cached and time.monotonic() - cached[1] < ttl:
+                return cached[0]
+            value = func(self, *args)
+            self.cache[key] = (value, time.monotonic())
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+class PriorityLookup:
+    """
+    Database lookups needed to prioritise messages, cached as they rarely change
+    """
+
+    def __init__(self):
+        self.cache = {}
+
+    @ttl_cache()
+    def is_prod_account(self, account_id):
+        with Session() as session:
+            account = session.get(Account, account_id)
+            return bool(account and account.is_prod())
+
+    @ttl_cache()
+    def is_deployed_image(self, account_id, image_name):
+        with Session() as session:
+            latest = (
+                session.query(LatestImage)
+                .join(Image, Image.id == LatestImage.image_id)
+                .filter(LatestImage.account_id == account_id, Image.name == image_name)
+                .first()
+            )
+            return latest is not None
+
+    @ttl_cache()
+    def is_deployed_repository(self, repository_url):
+        git_url = explode_git_url(repository_url)
+        with Session() as session:
+            latest = (
+                session.query(LatestImage)
+                .join(Image, Image.id == LatestImage.image_id)
+                .join(Repository, Repository.id == Image.repository_id)
+                .filter(Repository.org == git_url["org"], Repository.name == git_url["name"])
+                .first()
+            )
+            return latest is not None
+
+    def boost(self, message: dict) -> int:
+        """
+        Return how many seconds ahead of its arrival a message should be treated
+        """
+        repository, accounts, environment = describe(message)
+        is_bridge = environment is not None
+        try:
+            is_prod = any(self.is_prod_account(account) for account in accounts)
+            if is_bridge:
+                is_prod = is_prod or environment.casefold() == "prod"
+                is_deployed = bool(repository) and self.is_deployed_repository(repository)
+            else:
+                is_deployed = bool(repository) and any(
+                    self.is_deployed_image(account, repository) for account in accounts
+                )
+        except Exception:  # a bad message or db hiccup must not stop the daemon
+            logger.exception("Could not look up message priority")
+            return 0
+        return SCHEDULER_PROD_BOOST * is_prod + SCHEDULER_DEPLOYED_BOOST * is_deployed
+
+
+class Scheduler:
+    """
+    Hold received messages and hand out the most important one first.
+
+    A message's score is the number of seconds it has waited plus a boost for prod accounts and
+    for images (or repositories) that are currently deployed, so stage builds still get their
+    turn. No more than ``max_per_repository`` messages of one repository are run at a time.
+    """
+
+    def __init__(self, max_per_repository=DAEMON_MAX_PER_REPOSITORY, lookup=None):
+        self.max_per_repository = max_per_repository
+        self.lookup = lookup or PriorityLookup()
+        self.waiting = []  # [(message, repository, boost, received at)...]
+        self.running = Counter()  # repository: messages being processed
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def __iter__(self):
+        return (message for message, *_ in self.waiting)
+
+    def add(self, message: dict):
+        repository, _, _ = describe(message)
+        boost = self.lookup.boost(message)
+        self.waiting.append((message, repository, boost, time.monotonic()))
+
+    def best(self):
+        """
+        Return index of the best waiting message that may run now, None if there is none
+        """
+        now = time.monotonic()
+        best = None
+        best_rank = None
+        for index, (_, repository, boost, received_at) in enumerate(self.waiting):
+            running = self.running[repository] if repository else 0
+            if repository and running >= self.max_per_repository:
+                continue
+            rank = (boost + now - received_at, -running)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = index, rank
+        return best
+
+    def peek(self):
+        """
+        Return the best message that may run now without removing it, None if there is none
+        """
+        best = self.best()
+        return None if best is None else self.waiting[best][0]
+
+    def next(self):
+        """
+        Remove and return the best message that may run now, None if there is none
+        """
+        best = self.best()
+        if best is None:
+            return None
+        message, *_ = self.waiting.pop(best)
+        return message
+
+    def started(self, message: dict):
+        repository, _, _ = describe(message)
+        if repository:
+            self.running[repository] += 1
+
+    def finished(self, message: dict):
+        repository, _, _ = describe(message)
+        if repository and self.running[repository]:
+            self.running[repository] -= 1
+            if not self.running[repository]:
+                del self.running[repository]
+
+    def clear(self):
+        self.waiting.clear()
@@ -0,0 +1,175 @@
+import bisect
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import select
+
+from libinv.base import Session
+from libinv.daemon.scheduler import describe
+from libinv.env import DAEMON_NODE_NAME
+from libinv.env import SHARD_HEARTBEAT_INTERVAL
+from libinv.env import SHARD_MAX_REQUEUES
+from libinv.env import SHARD_NODE_TIMEOUT
+from libinv.env import SHARD_REQUEUE_DELAY
+from libinv.models import DaemonNode
+from libinv.sqs import requeue_info
+from libinv.sqs import requeued_body
+
+logger = logging.getLogger("libinv.daemon")
+
+RING_REPLICAS = 100  # points per node on the ring, more spreads keys more evenly
+
+
+class HashRing:
+    """
+    Consistent hash ring of nodes. When a node joins or leaves, only the keys it takes over (or
+    gives up) change owners.
+
+    >>> ring = HashRing(["node-a", "node-b", "node-c"])
+    >>> ring.owner("git@github.com:gitorg/libinv.git") in {"node-a", "node-b", "node-c"}
+    True
+    >>> bigger = HashRing(["node-a", "node-b", "node-c", "node-d"])
+    >>> keys = [f"repository-{i}" for i in range(1000)]
+    >>> moved = [key for key in keys if ring.owner(key) != bigger.owner(key)]
+    >>> 150 < len(moved) < 350
+    True
+    >>> all(bigger.owner(key) == "node-d" for key in moved)
+    True
+    >>> HashRing([]).owner("anything") is None
+    True
+    """
+
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        self.members = frozenset(nodes)
+        points = sorted(
+            (self.hash(f"{node}#{replica}"), node)
+            for node in self.members
+            for replica in range(replicas)
+        )
+        self.points = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def owner(self, key: str):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.nodes[index]
+
+
+class Sharder(threading.Thread):
+    """
+    Split messages among daemon nodes by repository (or image) name so that the same repository
+    keeps landing on the same node and its caches.
+
+    Every node keeps its row in the daemon_nodes table fresh and builds a hash ring of the nodes
+    seen within ``node_timeout`` seconds, so nodes that join or leave are taken into account on
+    the next heartbeat. A node puts back messages it doesn't own for another node to receive, but
+    processes them anyway once they have been put back ``max_requeues`` times so that nothing
+    waits on an owner that is gone or swamped.
+
+    A message is put back by sending a copy that counts how many times it was put back (see
+    ``requeued_body``) and deleting it, so that put backs are not taken for failed attempts.
+    """
+
+    def __init__(
+        self,
+        consumer,
+        node=DAEMON_NODE_NAME,
+        interval=SHARD_HEARTBEAT_INTERVAL,
+        node_timeout=SHARD_NODE_TIMEOUT,
+        max_requeues=SHARD_MAX_REQUEUES,
+        requeue_delay=SHARD_REQUEUE_DELAY,
+    ):
+        super().__init__(name="shard-heartbeat", daemon=True)
+        self.consumer = consumer
+        self.node = node
+        self.interval = interval
+        self.node_timeout = node_timeout
+        self.max_requeues = max_requeues
+        self.requeue_delay = requeue_delay
+        self.ring = HashRing([node])
+        self.stopped = threading.Event()
+
+    def start(self):
+        """
+        Join the ring and learn its other nodes before starting the heartbeat, as on a ring of this
+        node alone it would take every message for its own
+        """
+        self.beat()
+        super().start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.beat()
+            except Exception:
+                logger.exception("Could not refresh daemon nodes, keeping the last known ring")
+
+    def beat(self):
+        with Session() as session:
+            session.merge(DaemonNode(name=self.node, last_seen=func.now()))
+            session.commit()
+            nodes = session.scalars(
+                select(DaemonNode.name).where(
+                    DaemonNode.last_seen > func.now() - timedelta(seconds=self.node_timeout)
+                )
+            ).all()
+
+        if set(nodes) != self.ring.members:
+            logger.info(f"Rebalancing shards among nodes: {sorted(nodes)}")
+            self.ring = HashRing([self.node, *nodes])
+
+    def stop(self):
+        """
+        Leave the ring straight away rather than after ``node_timeout``
+        """
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        try:
+            with Session() as session:
+                session.execute(delete(DaemonNode).where(DaemonNode.name == self.node))
+                session.commit()
+        except Exception:
+            logger.exception("Could not remove node from daemon nodes")
+
+    def accepts(self, message: dict) -> bool:
+        repository, _, _ = describe(message)
+        if not repository or requeue_info(message)["requeues"] >= self.max_requeues:
+            return True
+        return self.ring.owner(repository) == self.node
+
+    def split(self, messages: list) -> list:
+        """
+        Return messages this node should process, put back the rest
+        """
+        accepted = []
+        requeued = []
+        for message in messages:
+            if self.accepts(message):
+                accepted.append(message)
+                continue
+            try:
+                self.consumer.send(requeued_body(message), delay=self.requeue_delay)
+            except Exception:
+                # it is received again once its visibility runs out, not counted as put back
+                logger.exception(f"Could not put back message {message.get('MessageId')}")
+                continue
+            requeued.append(message["ReceiptHandle"])
+
+        if requeued:
+            logger.debug(f"Put back {len(requeued)} messages owned by other nodes")
+            try:
+                for failure in self.consumer.delete(requeued):
+                    logger.warning(f"Could not delete message that was put back: {failure}")
+            except Exception:
+                logger.exception("Could not delete messages that were put back")
+        return accepted
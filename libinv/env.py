@@ -1,6 +1,7 @@
 import base64
 import json
 import os
+import socket
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -15,9 +16,38 @@ CRANE_BIN = os.getenv("CRANE_BIN", default="etc/third_party/crane")
 CDXGEN_BIN = os.getenv("CDXGEN_BIN", default="etc/third_party/node_modules/.bin/cdxgen")
 NPM_CONFIG_PREFIX = os.getenv("NPM_CONFIG_PREFIX", default="etc/third_party/node_modules")
 API_DOCS_FOLDER = os.getenv("API_DOCS_FOLDER", default="/app/docs/_build/html")
+ACTIONABLE_CACHE_SIZE = int(os.getenv("ACTIONABLE_CACHE_SIZE", default=256))
+ACTIONABLE_CACHE_TTL = int(os.getenv("ACTIONABLE_CACHE_TTL", default=600))
+GRAPH_CACHE_BYTES = int(os.getenv("GRAPH_CACHE_BYTES", default=512 * 1024**2))
+GRAPH_CACHE_FRESH_FOR = int(os.getenv("GRAPH_CACHE_FRESH_FOR", default=60))
+BLAST_RADIUS_MAX_PATHS = int(os.getenv("BLAST_RADIUS_MAX_PATHS", default=10))
+BLAST_RADIUS_TIME_BUDGET = int(os.getenv("BLAST_RADIUS_TIME_BUDGET", default=2))  # seconds
 
 AWS_REGION = os.getenv("AWS_DEFAULT_REGION")
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", default="sqs")  # sqs, local or postgres
 SQS_QUEUE_NAME = os.getenv("SQS_QUEUE_NAME")
+SQS_VISIBILITY_TIMEOUT = int(os.getenv("SQS_VISIBILITY_TIMEOUT", default=900))
+SQS_HEARTBEAT_INTERVAL = int(os.getenv("SQS_HEARTBEAT_INTERVAL", default=300))
+
+DAEMON_WORKERS = int(os.getenv("DAEMON_WORKERS", default=0))
+DAEMON_PREFETCH = int(os.getenv("DAEMON_PREFETCH", default=2))
+MESSAGE_MAX_ATTEMPTS = int(os.getenv("MESSAGE_MAX_ATTEMPTS", default=3))
+MESSAGE_RETRY_BACKOFF = int(os.getenv("MESSAGE_RETRY_BACKOFF", default=60))
+WASP_RESUME_WINDOW = int(os.getenv("WASP_RESUME_WINDOW", default=24 * 60 * 60))  # seconds
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", default=900))
+DAEMON_MAX_PER_REPOSITORY = int(os.getenv("DAEMON_MAX_PER_REPOSITORY", default=2))
+SCHEDULER_PROD_BOOST = int(os.getenv("SCHEDULER_PROD_BOOST", default=1800))
+SCHEDULER_DEPLOYED_BOOST = int(os.getenv("SCHEDULER_DEPLOYED_BOOST", default=900))
+ADMISSION_CONTROL = bool(int(os.getenv("ADMISSION_CONTROL", default=1)))
+ADMISSION_DISK_HEADROOM = int(os.getenv("ADMISSION_DISK_HEADROOM", default=2 * 1024**3))
+ADMISSION_DEFAULT_FOOTPRINT = int(os.getenv("ADMISSION_DEFAULT_FOOTPRINT", default=1024**3))
+ADMISSION_MEMORY_PER_SCAN = int(os.getenv("ADMISSION_MEMORY_PER_SCAN", default=2 * 1024**3))
+DAEMON_SHARDING = bool(int(os.getenv("DAEMON_SHARDING", default=0)))
+DAEMON_NODE_NAME = os.getenv("DAEMON_NODE_NAME", default=socket.gethostname())
+SHARD_HEARTBEAT_INTERVAL = int(os.getenv("SHARD_HEARTBEAT_INTERVAL", default=30))
+SHARD_NODE_TIMEOUT = int(os.getenv("SHARD_NODE_TIMEOUT", default=90))
+SHARD_MAX_REQUEUES = int(os.getenv("SHARD_MAX_REQUEUES", default=5))
+SHARD_REQUEUE_DELAY = int(os.getenv("SHARD_REQUEUE_DELAY", default=2))
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 
 GIT_SSH_KEY = os.getenv("GIT_SSH_KEY")
@@ -25,6 +55,8 @@ GIT_PROVIDER = os.getenv("GIT_PROVIDER")
 GIT_ORG = os.getenv("GIT_ORG")
 
 SLACK_URL = os.getenv("SLACK_URL")
+SLACK_MAX_REPORTS = int(os.getenv("SLACK_MAX_REPORTS", default=5))
+SLACK_REPORT_PERIOD = int(os.getenv("SLACK_REPORT_PERIOD", default=300))
 SERVICE_METADATA_URL = os.getenv("SERVICE_METADATA_URL")
 
 GO_PRIVATE = os.getenv("GO_PRIVATE")
@@ -49,7 +81,11 @@ IMAGE_SCAN_ENABLED = os.getenv("IMAGE_SCAN_ENABLED", default=False)
 JAVA_HOME = json.loads(os.getenv("JAVA_HOME", "{}"))
 BASE_IMAGE_JAVA_VERSION_MAPPING = json.loads(os.getenv("BASE_IMAGE_JAVA_VERSION_MAPPING", "{}"))
 
+SARIF_BATCH_SIZE = int(os.getenv("SARIF_BATCH_SIZE", default=500))
+
 LIBINV_TEMP_DIR = os.getenv("LIBINV_TEMP_DIR", default=f"{HOME}/scans")
+LOCAL_QUEUE_PATH = os.getenv("LOCAL_QUEUE_PATH", default=f"{LIBINV_TEMP_DIR}/queue.sqlite3")
+FLEET_GRAPH_PATH = os.getenv("FLEET_GRAPH_PATH", default=f"{HOME}/fleet/fleet-graph.zip")
 
 GITHUB_APP_APP_ID = os.getenv("GITHUB_APP_APP_ID")
 GITHUB_APP_INSTALLATION_ID = os.getenv("GITHUB_APP_INSTALLATION_ID")
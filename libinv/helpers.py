@@ -209,3 +209,25 @@ def explode_git_url(url: str):
         name = name[: -len(git_suffix)]
 
     return {"provider": provider, "org": org, "name": name}
+
+
+def directory_size(path) -> int:
+    """
+    Return bytes taken by files under path
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     _ = open(os.path.join(tmp, "file"), "w").write("x" * 10)
+    ...     os.mkdir(os.path.join(tmp, "dir"))
+    ...     _ = open(os.path.join(tmp, "dir", "file"), "w").write("x" * 5)
+    ...     directory_size(tmp)
+    15
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:  # gone already
+                pass
+    return size
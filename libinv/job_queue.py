@@ -0,0 +1,139 @@
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from libinv.base import Session
+from libinv.env import SQS_VISIBILITY_TIMEOUT
+from libinv.models import ScanJob
+from libinv.sqs import SQS_BATCH_SIZE
+
+logger = logging.getLogger("libinv.daemon")
+
+POLL_INTERVAL = 1  # seconds between looks at the table while long polling
+
+
+class JobQueue:
+    """
+    A queue in the scan_jobs table, so that any number of daemons can share work through
+    postgres alone.
+
+    Receiving claims visible jobs with ``SELECT ... FOR UPDATE SKIP LOCKED``, so two daemons never
+    claim the same job, and leases them for ``lease_timeout`` seconds. A job whose lease runs out
+    without it being deleted (its daemon died) is claimed again. Leases are extended the same way
+    sqs visibility is, and the receipt handle is only good for the lease it came with.
+    """
+
+    def __init__(self, lease_timeout=SQS_VISIBILITY_TIMEOUT):
+        self.lease_timeout = lease_timeout
+        self.node = f"{socket.gethostname()}:{os.getpid()}"
+
+    def send(self, body: str, delay=0) -> int:
+        with Session() as session:
+            job = ScanJob(body=body, visible_at=func.now() + timedelta(seconds=delay))
+            session.add(job)
+            session.commit()
+            return job.id
+
+    def receive(self, count=1, wait_time=20):
+        deadline = time.monotonic() + wait_time
+        while True:
+            messages = self._receive(count)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                return messages
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+    def _receive(self, count):
+        with Session() as session:
+            jobs = session.scalars(
+                select(ScanJob)
+                .where(ScanJob.visible_at <= func.now())
+                .order_by(ScanJob.visible_at, ScanJob.id)
+                .limit(count)
+                .with_for_update(skip_locked=True)
+            ).all()
+            for job in jobs:
+                job.attempts += 1
+                job.lease_token = str(uuid4())
+                job.leased_by = self.node
+                job.visible_at = func.now() + timedelta(seconds=self.lease_timeout)
+            messages = [
+                {
+                    "MessageId": str(job.id),
+                    "ReceiptHandle": f"{job.id}:{job.lease_token}",
+                    "Body": job.body,
+                    "Attributes": {"ApproximateReceiveCount": str(job.attempts)},
+                }
+                for job in jobs
+            ]
+            session.commit()
+        return messages
+
+    def poll(self, count=10):
+        messages = []
+        while not messages:
+            messages = self.receive(count=count)
+        return messages
+
+    def delete(self, receipt_handles: list):
+        """
+        Delete jobs with given receipt handles. Return entries that could not be deleted.
+        """
+        return self._update(receipt_handles, lambda session, job: session.delete(job))
+
+    def change_visibility(self, receipt_handles: list, timeout: int):
+        """
+        Extend leases of jobs with given receipt handles by ``timeout`` seconds. Return entries
+        that could not be changed.
+        """
+
+        def extend(session, job):
+            job.visible_at = func.now() + timedelta(seconds=timeout)
+
+        return self._update(receipt_handles, extend)
+
+    def _update(self, receipt_handles, update):
+        failed = []
+        with Session() as session:
+            for i, receipt_handle in enumerate(receipt_handles):
+                job_id, _, lease_token = receipt_handle.partition(":")
+                job = session.get(ScanJob, int(job_id), with_for_update=True)
+                if job is None or job.lease_token != lease_token:  # claimed again since
+                    failed.append(
+                        {
+                            "Id": str(i),
+                            "Code": "ReceiptHandleIsInvalid",
+                            "Message": f"No job leased with receipt handle {receipt_handle}",
+                            "SenderFault": True,
+                        }
+                    )
+                    continue
+                update(session, job)
+            session.commit()
+        return failed
+
+    def __len__(self):
+        with Session() as session:
+            return session.scalar(select(func.count()).select_from(ScanJob))
+
+
+def forward(source, queue, wait_time=20) -> int:
+    """
+    Move a batch of messages from ``source``, say sqs, into ``queue`` and return how many were
+    moved. A message is deleted from ``source`` only once it is in ``queue``, so none is lost, but
+    one whose delete fails is forwarded again, which the daemon's coalescer drops as a duplicate.
+    """
+    messages = source.receive(count=SQS_BATCH_SIZE, wait_time=wait_time)
+    if not messages:
+        return 0
+    for message in messages:
+        queue.send(message["Body"])
+    for failure in source.delete([message["ReceiptHandle"] for message in messages]):
+        logger.warning(f"Could not delete forwarded message: {failure}")
+    return len(messages)
@@ -0,0 +1,149 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from uuid import uuid4
+
+from libinv.env import LOCAL_QUEUE_PATH
+from libinv.env import SQS_VISIBILITY_TIMEOUT
+
+POLL_INTERVAL = 0.5  # seconds between looks at the queue while long polling
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    visible_at REAL NOT NULL,
+    receive_count INTEGER NOT NULL DEFAULT 0,
+    receipt_handle TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_visible_at ON messages (visible_at);
+CREATE INDEX IF NOT EXISTS messages_receipt_handle ON messages (receipt_handle);
+"""
+
+
+class LocalQueue:
+    """
+    A queue kept in a sqlite file, for load testing the daemon and replaying incidents locally.
+
+    It behaves like sqs as far as the daemon is concerned: a received message is hidden for
+    ``visibility_timeout`` seconds and is delivered again unless deleted in that time, every
+    delivery hands out a new receipt handle and counts towards ApproximateReceiveCount.
+    Any number of processes may share the file.
+    """
+
+    def __init__(self, path=LOCAL_QUEUE_PATH, visibility_timeout=SQS_VISIBILITY_TIMEOUT):
+        self.path = Path(path)
+        self.visibility_timeout = visibility_timeout
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        # A connection per call: sqlite connections can't be shared across threads or forks
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def transaction(self):
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")  # take the write lock before reading
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def send(self, body: str, delay=0) -> str:
+        message_id = str(uuid4())
+        now = time.time()
+        with self.connect() as db:
+            db.execute(
+                "INSERT INTO messages (id, body, sent_at, visible_at) VALUES (?, ?, ?, ?)",
+                (message_id, body, now, now + delay),
+            )
+        return message_id
+
+    def receive(self, count=1, wait_time=20):
+        deadline = time.monotonic() + wait_time
+        while True:
+            messages = self._receive(count)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                return messages
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+    def _receive(self, count):
+        now = time.time()
+        messages = []
+        with self.transaction() as db:
+            rows = db.execute(
+                "SELECT id, body, receive_count FROM messages WHERE visible_at <= ?"
+                " ORDER BY sent_at LIMIT ?",
+                (now, count),
+            ).fetchall()
+            for message_id, body, receive_count in rows:
+                receipt_handle = str(uuid4())
+                db.execute(
+                    "UPDATE messages SET visible_at = ?, receive_count = ?, receipt_handle = ?"
+                    " WHERE id = ?",
+                    (now + self.visibility_timeout, receive_count + 1, receipt_handle, message_id),
+                )
+                messages.append(
+                    {
+                        "MessageId": message_id,
+                        "ReceiptHandle": receipt_handle,
+                        "Body": body,
+                        "Attributes": {"ApproximateReceiveCount": str(receive_count + 1)},
+                    }
+                )
+        return messages
+
+    def poll(self, count=10):
+        messages = []
+        while not messages:
+            messages = self.receive(count=count)
+        return messages
+
+    def delete(self, receipt_handles: list):
+        """
+        Delete messages with given receipt handles. Return entries that could not be deleted.
+        """
+        return self._update("DELETE FROM messages WHERE receipt_handle = ?", receipt_handles)
+
+    def change_visibility(self, receipt_handles: list, timeout: int):
+        """
+        Hide messages with given receipt handles for another ``timeout`` seconds. Return entries
+        that could not be changed.
+        """
+        return self._update(
+            "UPDATE messages SET visible_at = ? WHERE receipt_handle = ?",
+            receipt_handles,
+            (time.time() + timeout,),
+        )
+
+    def _update(self, statement, receipt_handles, params=()):
+        failed = []
+        with self.transaction() as db:
+            for i, receipt_handle in enumerate(receipt_handles):
+                cursor = db.execute(statement, (*params, receipt_handle))
+                if not cursor.rowcount:  # delivered again since, or already deleted
+                    failed.append(
+                        {
+                            "Id": str(i),
+                            "Code": "ReceiptHandleIsInvalid",
+                            "Message": f"No message with receipt handle {receipt_handle}",
+                            "SenderFault": True,
+                        }
+                    )
+        return failed
+
+    def __len__(self):
+        with self.connect() as db:
+            return db.execute("SELECT count(*) FROM messages").fetchone()[0]
@@ -1,10 +1,12 @@
 import json
 import logging
-import subprocess
 
+from libinv.base import Session
+from libinv.blast_radius.index import write_reverse_index
 from libinv.env import IMAGE_SCAN_ENABLED
 from libinv.helpers import send_to_slack
 from libinv.helpers import upload_to_s3
+from libinv.package_index import index_repository_packages
 from libinv.scanners.image_scanner import scan_ecr_image
 from libinv.scanners.image_scanner import scan_orgsre_image
 from libinv.scanners.repository_scanner import Wasp
@@ -12,7 +14,12 @@ from libinv.scanners.repository_scanner import connect_using_queue_message_agree
 from libinv.scanners.repository_scanner import run_cdxgen_scan
 from libinv.scanners.repository_scanner import run_scancodeio
 from libinv.scanners.repository_scanner.sast import semgrep
-from libinv.sqs import delete_message
+from libinv.scanners.repository_scanner.stages import Stage
+from libinv.scanners.repository_scanner.stages import StageGraph
+from libinv.scanners.repository_scanner.stages import existing_path
+from libinv.sqs import REQUEUE_FIELD
+from libinv.sqs import attempt_count
+from libinv.sqs import requeue_info
 
 logger = logging.getLogger("libinv.main")
 
@@ -21,34 +28,90 @@ def process_message(message_metadata):
     return process_sqs_message(message_metadata)
 
 
+def bridge_stages(wasp) -> list:
+    """
+    Return stages of scanning a bridge message's repository. Once cloned, the bridge is connected,
+    cdxgen's sbom is sent off to ScanCode.io (its reverse dependency index uploaded next to it and
+    its packages indexed) and semgrep is run, all at the same time.
+    Local artifacts (the clone, the sbom) are reused by a resumed wasp only if they are still there.
+    """
+    wasp.project_dir  # resolve before stages read it from other threads
+    wasp_id, repository_id = wasp.id, wasp.repository_id
+
+    def clone(results):
+        return wasp.repo_dir
+
+    def connect(results):
+        connect_using_queue_message_agreement(wasp)
+
+    def cdxgen(results):
+        return run_cdxgen_scan(wasp)
+
+    def upload(results):
+        cdx_file = results["cdxgen"]
+        cdx_s3_object_name = str(cdx_file.relative_to(wasp.cwd))
+        upload_to_s3(file_name=str(cdx_file), object_name=cdx_s3_object_name)
+        return cdx_s3_object_name
+
+    def reverse_index(results):
+        index_file = write_reverse_index(results["cdxgen"])
+        index_s3_object_name = str(index_file.relative_to(wasp.cwd))
+        upload_to_s3(file_name=str(index_file), object_name=index_s3_object_name)
+        return index_s3_object_name
+
+    def package_index(results):
+        with Session() as session:
+            index_repository_packages(session, repository_id, wasp_id, results["cdxgen"])
+
+    def scancode(results):
+        return run_scancodeio(wasp, results["upload"])
+
+    def restore_clone(artifact):
+        return wasp.repo_dir if existing_path(artifact) else None
+
+    def sast(results):
+        semgrep.run_cicd(wasp, results["clone"])
+
+    return [
+        Stage("clone", clone, restore=restore_clone),
+        Stage("connect", connect, after=["clone"], exclusive=True),
+        Stage("cdxgen", cdxgen, after=["clone"], restore=existing_path),
+        Stage("upload", upload, after=["cdxgen"]),
+        Stage("reverse_index", reverse_index, after=["cdxgen"]),
+        Stage("package_index", package_index, after=["cdxgen"]),
+        Stage("scancode", scancode, after=["upload"]),
+        Stage("sast", sast, after=["clone"]),
+    ]
+
+
 def process_sqs_message(message_metadata: dict):
+    """
+    Process a queue message. Return True if the message is done with and can be deleted from the
+    queue, falsy if it should be delivered again.
+    """
     logger.debug(f"Received message: \n {message_metadata}")
     message_body = message_metadata["Body"]
 
     message = json.loads(message_body)
+    if isinstance(message, dict):
+        message.pop(REQUEUE_FIELD, None)  # about the queue, not the scan
 
     message_type = message.get("type", "").casefold()
     if message_type:  # New feature. Handling of messages based on types
         if message_type == "bridge":
-            with Wasp.eat_caterpillar_message(message) as wasp:
-                try:
-                    repository_dir = wasp.repo_dir
-
-                    connect_using_queue_message_agreement(wasp)
-
-                    cdx_file = run_cdxgen_scan(wasp)
-                    cdx_s3_object_name = str(cdx_file.relative_to(wasp.cwd))
-                    upload_to_s3(file_name=str(cdx_file), object_name=cdx_s3_object_name)
-
-                    run_scancodeio(wasp, cdx_s3_object_name)
-                    delete_message(message_metadata["ReceiptHandle"])
-
-                    semgrep.run_cicd(wasp, repository_dir)
-
-                except subprocess.TimeoutExpired as exc:
-                    logger.error("Timed out!", message)
-                    wasp.throw(f"Timed out: {exc}")
-                    return
+            # A message delivered again was left unfinished (say, its worker died), resume it
+            redelivered = attempt_count(message_metadata) > 1
+            wasp = Wasp.eat_caterpillar_message(
+                message,
+                message_id=requeue_info(message_metadata)["message_id"],
+                resume=redelivered,
+            )
+            if not wasp:  # excluded repository
+                return True
+
+            with wasp:
+                StageGraph(wasp, bridge_stages(wasp)).run()  # raises if a stage failed
+            return True
 
     elif IMAGE_SCAN_ENABLED:  # Legacy way of handling
         image_name = message["detail"]["repository-name"]
@@ -73,7 +136,7 @@ def process_sqs_message(message_metadata: dict):
                     # Uncomment for local run
                     # credentials=get_credentials_from_aws_okta(),
                 )
-        delete_message(message_metadata["ReceiptHandle"])
+        return True
 
 
 if __name__ == "__main__":
@@ -2,6 +2,8 @@ import json
 import logging
 import shutil
 from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
 from pathlib import Path
 from uuid import uuid4
 
@@ -9,6 +11,7 @@ from git import Repo
 from git.exc import GitCommandError
 from sqlalchemy import CHAR
 from sqlalchemy import JSON
+from sqlalchemy import BigInteger
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
@@ -35,11 +38,14 @@ from sqlalchemy.sql.expression import ClauseElement
 from libinv.base import Base
 from libinv.base import Session
 from libinv.base import conn
+from libinv.base import session_lock
 from libinv.env import EXCLUDED_REPOS
 from libinv.env import LIBINV_TEMP_DIR
+from libinv.env import WASP_RESUME_WINDOW
 from libinv.exceptions import ConflictingInfoError
 from libinv.exceptions import MalformedCaterpillarMessage
 from libinv.helpers import case_insensitive_dict
+from libinv.helpers import directory_size
 from libinv.helpers import explode_git_url
 from libinv.vcs import GitHubApp
 
@@ -144,6 +150,7 @@ class Package(Base):
     images = relationship("ImagePackageAssociation", back_populates="package")
     licenses = relationship("PackageLicenseAssociation", back_populates="package")
     vulnerabilities = relationship("VulnerabilityPackageAssociation", back_populates="package")
+    Index("idx_packages_lower_name", func.lower(name))
 
     def __str__(self):
         return self.purl
@@ -425,6 +432,12 @@ class Wasp(Base, TimestampMixin):  # Wasp eats caterpillars
     raw_message = Column(String(2048), nullable=False)
     ate_successfully = Column(Boolean(), nullable=False, default=True, server_default="1")
     complaints = Column(Text, default="")
+    stages = Column(JSON, default=dict)  # stage name: artifact, for each stage that is done
+    footprint = Column(BigInteger)  # bytes its files took on disk
+    message_id = Column(String(128))  # of the queue message it ate, to resume on redelivery
+    finished_at = Column(DateTime(timezone=True))  # once all its stages are done
+
+    Index("idx_wasps_message_id", message_id)
 
     images = relationship("Image", back_populates="wasp")
     repository = relationship("Repository")
@@ -439,7 +452,11 @@ class Wasp(Base, TimestampMixin):  # Wasp eats caterpillars
 
         if exc_type:
             self.throw(f"{exc_type} : {exc_value} : {traceback}")
+        else:
+            self.finished_at = datetime.now(timezone.utc)
 
+        if hasattr(self, "_project_dir"):
+            self.footprint = directory_size(self._project_dir)  # for admission of the next one
         conn.add(self)
         conn.commit()
         logger.debug(f"Cleaning up wasp {self}")
@@ -447,13 +464,13 @@ class Wasp(Base, TimestampMixin):  # Wasp eats caterpillars
             shutil.rmtree(self._project_dir)
             logger.debug(f"Delete {self._project_dir}")
 
-        return True
+        return False  # the error is recorded, let the daemon retry or quarantine the message
 
     def __str__(self):
         return f"{self.uuid}"
 
     @classmethod
-    def eat_caterpillar_message(cls, message: dict):
+    def eat_caterpillar_message(cls, message: dict, message_id: str = None, resume: bool = False):
         """
         Messages are eaten as per the following agreement:
 
@@ -474,6 +491,11 @@ class Wasp(Base, TimestampMixin):  # Wasp eats caterpillars
                 "platform": <Only present for Image>
             }...]
         }
+
+        If ``resume`` is set (the message is being delivered again), the latest wasp that ate
+        the same queue message (``message_id``, not just the same body: a message sent again is a
+        new scan) is returned instead of a new one so that it picks up its stages where it left
+        them. Only wasps that are unfinished and younger than ``WASP_RESUME_WINDOW`` are resumed.
         """
         repository_url = message["repository"]["url"]
         commit = message["repository"]["commit"]
@@ -497,6 +519,25 @@ class Wasp(Base, TimestampMixin):  # Wasp eats caterpillars
                 f" given url: {repository_url}"
             )
 
+        if resume and message_id:
+            wasp = (
+                conn.query(cls)
+                .filter(
+                    cls.message_id == message_id,
+                    cls.repository == repository,
+                    cls.finished_at.is_(None),
+                    cls.created_at
+                    >= datetime.now(timezone.utc) - timedelta(seconds=WASP_RESUME_WINDOW),
+                )
+                .order_by(cls.id.desc())
+                .first()
+            )
+            if wasp:
+                wasp.ate_successfully = True  # till a stage that is run again fails
+                conn.commit()
+                logger.info(f"Wasp resumed caterpillar: {wasp}, done: {list(wasp.stages or {})}")
+                return wasp
+
         wasp = cls(
             repository=repository,
             tag=tag,
@@ -504,6 +545,7 @@ class Wasp(Base, TimestampMixin):  # Wasp eats caterpillars
             raw_message=raw_message,
             environment=environment,
             jenkins_url=jenkins_url,
+            message_id=message_id,
         )
         conn.add(wasp)
         conn.commit()
@@ -518,14 +560,24 @@ class Wasp(Base, TimestampMixin):  # Wasp eats caterpillars
         """
         Throw some food out. Specify why any actions on wasp failed without failing entire libinv
         """
-        try:
-            conn.connection()
-        except PendingRollbackError:
-            conn.rollback()
+        with session_lock:
+            try:
+                conn.connection()
+            except PendingRollbackError:
+                conn.rollback()
+
+            self.complaints += why
+            self.ate_successfully = False
+            logger.error(f"{self} raised: {why}")
 
-        self.complaints += why
-        self.ate_successfully = False
-        logger.error(f"{self} raised: {why}")
+    def checkpoint(self, stage: str, artifact=None):
+        """
+        Record that a stage is done along with where its artifact is (a path, an s3 key...)
+        """
+        with session_lock:
+            self.stages = {**(self.stages or {}), stage: artifact}  # reassign so it is saved
+            conn.add(self)
+            conn.commit()
 
     @property
     def project_dir(self) -> Path:
@@ -543,7 +595,11 @@ class Wasp(Base, TimestampMixin):  # Wasp eats caterpillars
     @property
     def repo_dir(self):
         if not hasattr(self, "_repo_dir"):
-            self._repo_dir = self.clone()
+            cloned = (self.stages or {}).get("clone")
+            if cloned and Path(cloned).is_dir():  # left by an earlier attempt
+                self._repo_dir = Path(cloned)
+            else:
+                self._repo_dir = self.clone()
 
         return self._repo_dir
 
@@ -629,6 +685,80 @@ class SastResult(Base, TimestampMixin):
     mean_solve_time = Column(Integer)
 
 
+class QuarantinedMessage(Base, TimestampMixin):
+    """
+    Queue messages that could not be processed even after retries. Kept here instead of being
+    retried forever so that one bad message does not hold up the queue.
+    """
+
+    __tablename__ = "quarantined_messages"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message_id = Column(String(128))
+    body = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=1)
+    error = Column(Text)
+
+    def __str__(self):
+        return f"{self.message_id}"
+
+
+class ScanJob(Base, TimestampMixin):
+    """
+    Queue messages kept in the database for daemons that use it as their queue. A job is leased
+    to one daemon at a time: it stays invisible to others till ``visible_at``.
+    """
+
+    __tablename__ = "scan_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    body = Column(Text, nullable=False)
+    visible_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    attempts = Column(Integer, nullable=False, default=0)
+    lease_token = Column(String(36))
+    leased_by = Column(String(256))
+    Index("idx_scan_jobs_visible_at", visible_at)
+
+    def __str__(self):
+        return f"{self.id}"
+
+
+class DaemonNode(Base):
+    """
+    Daemon nodes taking part in sharding, along with when each was last heard from
+    """
+
+    __tablename__ = "daemon_nodes"
+
+    name = Column(String(256), primary_key=True)
+    last_seen = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    def __str__(self):
+        return self.name
+
+
+class RepositoryPackage(Base, TimestampMixin):
+    """
+    Packages in the latest cdxgen sbom of each repository, by lowercased name, so that fleet wide
+    questions like which repositories have log4j-core below 2.17 are a single indexed query
+    """
+
+    __tablename__ = "repository_packages"
+
+    repository_id = Column(
+        ForeignKey("libinv.repositories.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    purl = Column(Text, primary_key=True)
+    name = Column(String(200), nullable=False)  # lowercased
+    version = Column(String(150))
+    wasp_id = Column(ForeignKey("libinv.wasps.id", onupdate="CASCADE", ondelete="SET NULL"))
+    Index("idx_repository_packages_name", name)
+
+    def __str__(self):
+        return self.purl
+
+
 # https://stackoverflow.com/a/2587041/2251364
 def get_or_create(session, model, defaults=None, **kwargs):
     instance = session.query(model).filter_by(**kwargs).one_or_none()
@@ -0,0 +1,199 @@
+import json
+import logging
+import re
+from pathlib import Path
+
+from packaging.specifiers import InvalidSpecifier
+from packaging.specifiers import SpecifierSet
+from packaging.version import InvalidVersion
+from packaging.version import Version
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import select
+
+from libinv.models import Image
+from libinv.models import ImagePackageAssociation
+from libinv.models import LatestImage
+from libinv.models import Package
+from libinv.models import Repository
+from libinv.models import RepositoryPackage
+
+logger = logging.getLogger("libinv.package_index")
+
+LEADING_VERSION = re.compile(r"v?(\d+(\.\d+)*)")
+
+
+def normalize_name(name: str) -> str:
+    """
+    >>> normalize_name(" Log4j-Core ")
+    'log4j-core'
+    """
+    return name.strip().lower()
+
+
+def comparable_version(version: str):
+    """
+    Return a version that can be compared, going by its leading numbers if it is not PEP 440,
+    None if it has none
+
+    >>> comparable_version("2.17.1") < comparable_version("2.17.10")
+    True
+    >>> comparable_version("2.14.1-SNAPSHOT")
+    <Version('2.14.1')>
+    >>> comparable_version("latest") is None
+    True
+    """
+    if not version:
+        return None
+    try:
+        return Version(version)
+    except InvalidVersion:
+        pass
+    match = LEADING_VERSION.match(version.strip())
+    return Version(match.group(1)) if match else None
+
+
+def version_specifier(specifier: str) -> SpecifierSet:
+    """
+    Return a specifier of versions, like ``<2.17`` or ``>=2.0,<2.17``, raising ValueError if it is
+    not one
+
+    >>> "2.14.1" in version_specifier("<2.17")
+    True
+    """
+    try:
+        return SpecifierSet(specifier or "", prereleases=True)
+    except InvalidSpecifier as e:
+        raise ValueError(f"Invalid version specifier {specifier!r}") from e
+
+
+def version_matches(version: str, specifier: SpecifierSet) -> bool:
+    """
+    Return whether a version is one of specified versions. Versions that can't be compared are
+    taken to match, as missing an affected package is worse than listing one too many.
+
+    >>> version_matches("2.14.1", version_specifier("<2.17"))
+    True
+    >>> version_matches("2.17.1", version_specifier("<2.17"))
+    False
+    >>> version_matches("latest", version_specifier("<2.17"))
+    True
+    """
+    if not specifier:
+        return True
+    comparable = comparable_version(version)
+    return comparable is None or comparable in specifier
+
+
+def cdx_packages(components: list):
+    """
+    Yield (purl, name, version) of components of a CDX sbom, nested ones included
+
+    >>> list(cdx_packages([{"name": "Web", "version": "1", "purl": "pkg:npm/web@1",
+    ...     "components": [{"name": "left-pad", "version": "1.3.0", "purl": "pkg:npm/left-pad@1.3.0"}]}]))
+    [('pkg:npm/web@1', 'web', '1'), ('pkg:npm/left-pad@1.3.0', 'left-pad', '1.3.0')]
+    """
+    for component in components:
+        purl = component.get("purl") or component.get("bom-ref")
+        if purl and component.get("name"):
+            yield purl, normalize_name(component["name"]), component.get("version")
+        yield from cdx_packages(component.get("components", []))
+
+
+def index_repository_packages(session, repository_id: int, wasp_id: int, sbom: Path) -> int:
+    """
+    Replace packages of a repository in the index with those in its sbom. Return their count.
+    """
+    with open(sbom) as cdx:
+        packages = {
+            purl: (name, version)
+            for purl, name, version in cdx_packages(json.load(cdx).get("components", []))
+        }
+    rows = [
+        {
+            "repository_id": repository_id,
+            "purl": purl,
+            "name": name[: RepositoryPackage.name.type.length],
+            "version": version and version[: RepositoryPackage.version.type.length],
+            "wasp_id": wasp_id,
+        }
+        for purl, (name, version) in packages.items()
+    ]
+    session.execute(
+        delete(RepositoryPackage).where(RepositoryPackage.repository_id == repository_id)
+    )
+    if rows:
+        session.execute(insert(RepositoryPackage), rows)
+    session.commit()
+    logger.info(f"Indexed {len(rows)} packages of repository {repository_id}")
+    return len(rows)
+
+
+def find_package(session, name: str, specifier: str = "", deployed_only=False) -> dict:
+    """
+    Return repositories (going by their latest sbom) and images (going by syft) that have a
+    package of a name, in versions matching a specifier if one is given
+    """
+    specifier = version_specifier(specifier)
+    name = normalize_name(name)
+
+    repositories = session.execute(
+        select(
+            Repository.id,
+            Repository.org,
+            Repository.name,
+            RepositoryPackage.version,
+            RepositoryPackage.purl,
+            RepositoryPackage.wasp_id,
+        )
+        .join(Repository, Repository.id == RepositoryPackage.repository_id)
+        .where(RepositoryPackage.name == name)
+        .order_by(Repository.org, Repository.name)
+    ).all()
+
+    images = (
+        select(
+            Image.id,
+            Image.name,
+            Image.tag,
+            Image.digest,
+            Image.account_id,
+            Package.version,
+            Package.purl,
+        )
+        .join(ImagePackageAssociation, ImagePackageAssociation.image_id == Image.id)
+        .join(Package, Package.id == ImagePackageAssociation.package_id)
+        .where(func.lower(Package.name) == name)
+        .order_by(Image.name, Image.id)
+    )
+    if deployed_only:
+        images = images.join(LatestImage, LatestImage.image_id == Image.id)
+    images = session.execute(images).all()
+
+    return {
+        "repositories": [
+            {
+                "id": row.id,
+                "repository": f"{row.org}/{row.name}",
+                "version": row.version,
+                "purl": row.purl,
+                "wasp_id": row.wasp_id,
+            }
+            for row in repositories
+            if version_matches(row.version, specifier)
+        ],
+        "images": [
+            {
+                "id": row.id,
+                "image": row.name,
+                "tag": row.tag,
+                "digest": row.digest,
+                "account_id": row.account_id,
+                "version": row.version,
+                "purl": row.purl,
+            }
+            for row in images
+            if version_matches(row.version, specifier)
+        ],
+    }
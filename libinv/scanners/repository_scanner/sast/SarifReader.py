@@ -0,0 +1,75 @@
+import json
+import logging
+import tempfile
+
+import ijson
+
+logger = logging.getLogger("libinv.SarifReader")
+
+RULE_PREFIX = "runs.item.tool.driver.rules.item"
+RESULT_PREFIX = "runs.item.results.item"
+
+
+def iter_sarif_items(sarif):
+    """
+    Yield (prefix, item) for every rule and result in a SARIF stream, in file order.
+    Only one rule or result is held in memory at a time.
+    """
+    builder = None
+    depth = 0
+    item_prefix = None
+    for prefix, event, value in ijson.parse(sarif, use_float=True):
+        if builder is None:
+            if prefix in (RULE_PREFIX, RESULT_PREFIX) and event == "start_map":
+                builder = ijson.ObjectBuilder()
+                item_prefix = prefix
+                depth = 0
+            else:
+                continue
+
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+
+        if depth == 0:
+            yield item_prefix, builder.value
+            builder = None
+
+
+def read_sarif(sarif, spool_dir=None):
+    """
+    Yield ("rule", rule) for every rule first and then ("result", result) for every result.
+
+    semgrep writes results before the rule metadata, so results seen before the rules are
+    spooled to a temporary file instead of being kept in memory. The SARIF file itself is read
+    only once.
+
+    >>> import io
+    >>> sarif = io.BytesIO(
+    ...     b'{"runs": [{"results": [{"ruleId": "a", "properties": {"n": [1]}}],'
+    ...     b' "tool": {"driver": {"rules": [{"id": "a"}]}}}]}'
+    ... )
+    >>> list(read_sarif(sarif))
+    [('rule', {'id': 'a'}), ('result', {'ruleId': 'a', 'properties': {'n': [1]}})]
+    """
+    rules_seen = False
+    with tempfile.TemporaryFile(mode="w+", dir=spool_dir) as spool:
+        spooled = 0
+        for prefix, item in iter_sarif_items(sarif):
+            if prefix == RULE_PREFIX:
+                rules_seen = True
+                yield "rule", item
+            elif rules_seen:
+                yield "result", item
+            else:
+                spool.write(json.dumps(item))
+                spool.write("\n")
+                spooled += 1
+
+        if spooled:
+            logger.debug(f"Replaying {spooled} spooled sarif results")
+            spool.seek(0)
+            for line in spool:
+                yield "result", json.loads(line)
@@ -1,12 +1,19 @@
 import json
 import logging
 
+from sqlalchemy import Integer
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import update
+
 from libinv.base import conn
+from libinv.env import SARIF_BATCH_SIZE
 from libinv.models import SastLobMetaData
 from libinv.models import SastResult
 from libinv.scanners.repository_scanner.sast.enums.ConfidenceEnum import ConfidenceEnum
 from libinv.scanners.repository_scanner.sast.enums.PriorityEnum import PriorityEnum
 from libinv.scanners.repository_scanner.sast.enums.ValidEnum import ValidEnum
+from libinv.scanners.repository_scanner.sast.SarifReader import read_sarif
 from libinv.scanners.repository_scanner.sast.semgrep import utils
 from libinv.scanners.repository_scanner.sast.semgrep.modes.DefaultMode import DefaultMode
 
@@ -19,7 +26,7 @@ class SarifResult:
     """
 
     def __init__(self, config, sariffile, source) -> None:
-        self.sarifjson = json.load(open(sariffile, "r"))
+        self.sariffile = sariffile
         self.config = config
         self.source = source
         default_module = DefaultMode(config)
@@ -28,15 +35,37 @@ class SarifResult:
             "default": default_module
         }
         self.memo_lob_id = {}  # { pod::subpod::module :  lob_id from sast_meta db} cache
-        self.rulemetadata = self.parsesarifmetadata()
+        self.seen_fingerprints = set()  # fingerprints present in this scan
+        self.rulemetadata = {}
+
+    def ingest(self, batch_size=SARIF_BATCH_SIZE):
+        """
+        Stream the sarif file and add its results to db in batches of ``batch_size``
+        """
+        batch = []
+        with open(self.sariffile, "rb") as sarif:
+            for kind, item in read_sarif(sarif, spool_dir=self.config.wasp.project_dir):
+                if kind == "rule":
+                    self.parse_rule_metadata(item)
+                    continue
 
-    def add_lob_module(self):
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    self.add_lob_module(batch)
+                    self.add_sarif_result_to_db(batch)
+                    batch = []
+
+        if batch:
+            self.add_lob_module(batch)
+            self.add_sarif_result_to_db(batch)
+
+    def add_lob_module(self, sarif_rows):
         """
         add :  POD | SUBPOD | module(idor/sqli) | submodeul(libinv.idor.rule-1)
         into db if not exist
         """
 
-        for i, sarif_row in enumerate(self.sarifjson["runs"][0]["results"]):
+        for sarif_row in sarif_rows:
             pod = self.config.wasp.repository.pod
             subpod = self.config.wasp.repository.subpod
             ruleid = sarif_row["ruleId"]
@@ -71,15 +100,25 @@ class SarifResult:
                 conn.commit()
                 self.memo_lob_id[key] = metadata.id
 
-    def add_sarif_result_to_db(self):
-        for i, sarif_row in enumerate(self.sarifjson["runs"][0]["results"]):
+    def add_sarif_result_to_db(self, sarif_rows):
+        fingerprinted_rows = []
+        for sarif_row in sarif_rows:
             full_path = sarif_row["locations"][0]["physicalLocation"]["artifactLocation"]["uri"]
             subpath_without_base = full_path[len(str(self.config.base_code_directory)) :]
             fingerprint = utils.fingerprint_semgrep_single_result_sarif(
                 sarif_row, subpath_without_base
             )
+            fingerprinted_rows.append((fingerprint, full_path, subpath_without_base, sarif_row))
 
-            record = conn.query(SastResult).filter_by(id=fingerprint).first()
+        fingerprints = [fingerprint for fingerprint, *_ in fingerprinted_rows]
+        records = {
+            record.id: record
+            for record in conn.query(SastResult).filter(SastResult.id.in_(fingerprints))
+        }
+
+        for fingerprint, full_path, subpath_without_base, sarif_row in fingerprinted_rows:
+            self.seen_fingerprints.add(fingerprint)
+            record = records.get(fingerprint)
 
             prioriy = PriorityEnum.MEDIUM  # default Priority
             public_initial_point = ""
@@ -95,6 +134,12 @@ class SarifResult:
                 else self.rulesId_ModeParser["default"]
             )
 
+            if record and not record.isactive:
+                # finding was closed by an earlier scan but is back again
+                record.isactive = True
+                record.fixed_date = None
+                record.mean_solve_time = None
+
             if record and record.validated != ValidEnum.NOTVALIDATED.value:
                 continue  # record already exist and validated by SPOC: just move to next
 
@@ -124,14 +169,19 @@ class SarifResult:
             key = self.make_memo_key(pod, subpod, submodule)
 
             if record:
-                if extras["public_endpoints"] == record.extras["public_endpoints"]:
+                # extras are stored as a json string
+                record_extras = record.extras
+                if isinstance(record_extras, str):
+                    record_extras = json.loads(record_extras)
+
+                if extras["public_endpoints"] == record_extras.get("public_endpoints"):
                     continue
                 else:
                     # db entry not yet validated manually by SPOC have changed
-                    record.extras["public_endpoints"] = extras["public_endpoints"]
+                    record_extras["public_endpoints"] = extras["public_endpoints"]
+                    record.extras = json.dumps(record_extras)
                     record.public_initial_point = public_initial_point
                     record.priority = prioriy.value
-                    conn.commit()
                     continue
 
             record = SastResult(
@@ -157,10 +207,42 @@ class SarifResult:
                 file_path=str(subpath_without_base),
             )
             conn.add(record)
-            conn.commit()
+            records[fingerprint] = record  # same finding may be reported twice in a batch
 
+        conn.commit()
         return
 
+    def close_missing_results(self):
+        """
+        Mark every active result of this repository that is not present in the current scan as
+        fixed. Done in a single UPDATE so that stale findings never have to be loaded in python.
+        mean_solve_time is stored in days.
+        """
+        repository_lobs = select(SastLobMetaData.id).where(
+            SastLobMetaData.repository_id == self.config.wasp.repository_id
+        )
+        stmt = (
+            update(SastResult)
+            .where(
+                SastResult.lob_id.in_(repository_lobs),
+                SastResult.source == str(self.source.value),
+                SastResult.isactive.is_(True),
+                SastResult.id.not_in(self.seen_fingerprints),
+            )
+            .values(
+                isactive=False,
+                fixed_date=func.now(),
+                mean_solve_time=func.cast(
+                    func.extract("epoch", func.now() - SastResult.created_at) / 86400, Integer
+                ),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        closed = conn.execute(stmt).rowcount
+        conn.commit()
+        logger.info(f"Closed {closed} fixed findings for {self.config.wasp.repository}")
+        return closed
+
     def make_memo_key(self, pod, subpod, module):
         return f"{pod}::{subpod}::{module}"
 
@@ -173,13 +255,8 @@ class SarifResult:
         giturl = f"{repo_url}/blob/{branch}/{relative_path}#L{line_number}"
         return giturl
 
-    def parsesarifmetadata(self):
-        metadata = {}
-
-        for i, semgrep in enumerate(self.sarifjson["runs"][0]["tool"]["driver"]["rules"]):
-            metadata[semgrep["id"]] = {
-                "description": semgrep["fullDescription"]["text"],
-                "properties": semgrep["properties"],
-            }
-
-        return metadata
+    def parse_rule_metadata(self, rule):
+        self.rulemetadata[rule["id"]] = {
+            "description": rule["fullDescription"]["text"],
+            "properties": rule["properties"],
+        }
@@ -15,6 +15,7 @@ class SemgrepRunner:
             str(config.wasp.project_dir)
             + f"/output/semgrep_result/out_{config.wasp.repository.name}_latest"
         )
+        self.exit_code = None
 
     def run_semgrep(self):
         """
@@ -27,10 +28,16 @@ class SemgrepRunner:
         cmd = f"semgrep --no-git-ignore --config={rules_m} --sarif  --timeout 0 --output '{self.output_file}' '{self.config.base_code_directory}'"
         logger.info("[INFO] EXEC Running:: " + cmd)
 
-        utils.exec(cmd)
+        self.exit_code = utils.exec(cmd)
+        if self.exit_code != 0:
+            logger.error(f"semgrep exited with {self.exit_code}, its results may be partial")
 
         return self.output_file
 
     def run(self):
         self.run_semgrep()
         return
+
+    @property
+    def succeeded(self):
+        return self.exit_code == 0
@@ -1,3 +1,4 @@
+from libinv.base import session_lock
 from libinv.project_language_detector import Project_language_detector
 from libinv.scanners.repository_scanner.sast.enums.CodeTech import CodeTech
 from libinv.scanners.repository_scanner.sast.enums.SastSourceEnum import SastSourceEnum
@@ -8,15 +9,19 @@ from libinv.scanners.repository_scanner.sast.semgrep.SemgrepRunner import Semgre
 
 
 def main(args):
-    config = Config.Config(args)
-
-    semgrepRunner = SemgrepRunner(config)
+    # wasp may be shared with other stages, only touch the db session with the lock held
+    with session_lock:
+        config = Config.Config(args)
+        semgrepRunner = SemgrepRunner(config)
 
     semgrepRunner.run()  # gives SarifResult Object
-    result = SarifResult(config, semgrepRunner.output_file, SastSourceEnum.SEMGREP)
 
-    result.add_lob_module()  # add all modules ran to db
-    result.add_sarif_result_to_db()  # add sarif result to db
+    with session_lock:
+        result = SarifResult(config, semgrepRunner.output_file, SastSourceEnum.SEMGREP)
+        result.ingest()  # add all modules ran and sarif results to db, in batches
+        # a failed run may have left out findings that are still there, never close them off it
+        if semgrepRunner.succeeded:
+            result.close_missing_results()  # mark findings absent from this scan as fixed
 
 
 def run_cicd(wasp, code_directory):
@@ -101,7 +101,10 @@ def create_folder(folder):
 
 
 def exec(cmd):  # this can be wrapped around a class
-    os.system(cmd)
+    """
+    Run a shell command and return its exit code
+    """
+    return os.waitstatus_to_exitcode(os.system(cmd))
 
 
 def replace_with_uuid(path):
@@ -54,3 +54,4 @@ def run(
     if name:
         url = f"{SCANCODEIO_URL}/project/?search={name}"
         logger.info(f"[+] ScancodeIO task: {url}")
+        return url
@@ -0,0 +1,230 @@
+import subprocess
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
+from attrs import define
+from attrs import field
+
+from libinv.base import session_lock
+from libinv.scanners.repository_scanner.logger import logger
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+@define
+class Stage:
+    """
+    A step of scanning a wasp. ``func`` is called with results of the stages done so far and its
+    return value is the result of this stage.
+    Stages that use the shared db session are ``exclusive``: they hold the session lock throughout.
+
+    The result is checkpointed on the wasp as the stage's artifact. When the wasp is resumed,
+    ``restore`` is called with the artifact and should return the result, or None if the artifact
+    can't be used anymore (say, a file of a crashed worker's node). Without ``restore`` the
+    artifact is taken as is.
+    """
+
+    name: str
+    func: Callable
+    after: Tuple[str, ...] = field(default=(), converter=tuple)
+    exclusive: bool = False
+    restore: Optional[Callable] = None
+
+
+def existing_path(artifact) -> Optional[Path]:
+    """
+    Restore a path artifact if it is still there
+
+    >>> existing_path("/")
+    PosixPath('/')
+    >>> existing_path("/nonexistent/sbom.cdx.json") is None
+    True
+    """
+    if artifact and Path(artifact).exists():
+        return Path(artifact)
+    return None
+
+
+class StageGraph:
+    """
+    Run stages of a wasp, each as soon as all the stages it comes after are done, so that
+    independent ones (say, cdxgen and semgrep on the same checkout) run at the same time.
+
+    A stage that fails is complained about on the wasp and every stage after it is skipped, the
+    rest carry on. Once they are all done (and checkpointed), the first failure is raised so that
+    the daemon retries or quarantines the message as it does for any other error. Stages that a
+    previous attempt on the wasp finished are not run again.
+    """
+
+    def __init__(self, wasp, stages):
+        self.wasp = wasp
+        self.name = str(wasp)  # reading the wasp later may hit the db session, do it only once
+        self.stages = {stage.name: stage for stage in stages}
+        self.status = {}  # stage name: DONE/FAILED/SKIPPED
+        self.results = {}  # stage name: return value
+        self.failures = []  # exceptions of failed stages, in the order they failed
+
+    def restore(self):
+        """
+        Take over results of stages checkpointed on the wasp. A stage whose artifact is gone runs
+        again, unless every stage after it is done already.
+
+        >>> from types import SimpleNamespace
+        >>> wasp = SimpleNamespace(stages={"clone": "/nonexistent/clone", "cdxgen": "sbom.json"})
+        >>> graph = StageGraph(
+        ...     wasp,
+        ...     [
+        ...         Stage("clone", print, restore=existing_path),
+        ...         Stage("cdxgen", print, after=["clone"]),
+        ...         Stage("upload", print, after=["cdxgen"]),
+        ...         Stage("sast", print, after=["clone"]),
+        ...     ],
+        ... )
+        >>> graph.restore()
+        >>> graph.status, graph.results
+        ({'cdxgen': 'done'}, {'cdxgen': 'sbom.json'})
+        >>> wasp.stages["sast"] = "sarif.json"
+        >>> graph.restore()
+        >>> graph.status
+        {'cdxgen': 'done', 'sast': 'done', 'clone': 'done'}
+        """
+        checkpoints = self.wasp.stages or {}
+        for stage in self.stages.values():
+            if stage.name not in checkpoints:
+                continue
+            artifact = checkpoints[stage.name]
+            result = stage.restore(artifact) if stage.restore else artifact
+            if stage.restore and result is None:
+                logger.info(f"{self.name}: Artifact of stage {stage.name} is gone: {artifact}")
+                continue
+            logger.info(f"{self.name}: Restored stage {stage.name}")
+            self.results[stage.name] = result
+            self.status[stage.name] = DONE
+
+        # A stage whose results are needed only by stages already done need not run again
+        unneeded = True
+        while unneeded:
+            unneeded = False
+            for stage in self.stages.values():
+                if stage.name in self.status:
+                    continue
+                dependents = [other for other in self.stages.values() if stage.name in other.after]
+                if dependents and all(self.status.get(other.name) == DONE for other in dependents):
+                    self.status[stage.name] = DONE
+                    unneeded = True
+
+    def ready(self, running):
+        return [
+            stage
+            for stage in self.stages.values()
+            if stage.name not in self.status
+            and stage not in running
+            and all(self.status.get(name) == DONE for name in stage.after)
+        ]
+
+    def skip_blocked(self):
+        """
+        Skip stages after a stage that failed or was skipped
+
+        >>> from types import SimpleNamespace
+        >>> graph = StageGraph(
+        ...     SimpleNamespace(stages={}),
+        ...     [
+        ...         Stage("clone", print),
+        ...         Stage("cdxgen", print, after=["clone"]),
+        ...         Stage("upload", print, after=["cdxgen"]),
+        ...         Stage("scancode", print, after=["upload"]),
+        ...         Stage("sast", print, after=["clone"]),
+        ...     ],
+        ... )
+        >>> graph.status.update(clone=DONE, cdxgen=FAILED)
+        >>> graph.skip_blocked()
+        >>> graph.status
+        {'clone': 'done', 'cdxgen': 'failed', 'upload': 'skipped', 'scancode': 'skipped'}
+        >>> [stage.name for stage in graph.ready([])]
+        ['sast']
+        """
+        skipped = True
+        while skipped:  # until skips stop cascading
+            skipped = False
+            for stage in self.stages.values():
+                if stage.name in self.status:
+                    continue
+                if any(self.status.get(name) in (FAILED, SKIPPED) for name in stage.after):
+                    logger.info(f"{self.name}: Skipping stage {stage.name}")
+                    self.status[stage.name] = SKIPPED
+                    skipped = True
+
+    def run(self) -> dict:
+        """
+        Run all stages, return status of each. Raise the first failure if any stage failed.
+
+        >>> from types import SimpleNamespace
+        >>> checkpoints = {}
+        >>> wasp = SimpleNamespace(stages={}, checkpoint=checkpoints.__setitem__, throw=len)
+        >>> def cdxgen(results):
+        ...     raise ValueError("cdxgen crashed")
+        >>> graph = StageGraph(
+        ...     wasp,
+        ...     [
+        ...         Stage("clone", lambda results: "clone"),
+        ...         Stage("cdxgen", cdxgen, after=["clone"]),
+        ...         Stage("upload", print, after=["cdxgen"]),
+        ...         Stage("sast", lambda results: results["clone"] + ".sarif", after=["clone"]),
+        ...     ],
+        ... )
+        >>> graph.run()
+        Traceback (most recent call last):
+        ...
+        ValueError: cdxgen crashed
+        >>> sorted(graph.status.items())
+        [('cdxgen', 'failed'), ('clone', 'done'), ('sast', 'done'), ('upload', 'skipped')]
+        >>> sorted(checkpoints.items())
+        [('clone', 'clone'), ('sast', 'clone.sarif')]
+        """
+        self.restore()
+        with ThreadPoolExecutor(
+            max_workers=len(self.stages) or 1, thread_name_prefix=f"wasp-{self.name}"
+        ) as executor:
+            running = {}  # future: stage
+            while True:
+                self.skip_blocked()
+                for stage in self.ready(running.values()):
+                    running[executor.submit(self.run_stage, stage)] = stage
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    self.status[stage.name] = future.result()
+        if self.failures:
+            raise self.failures[0]
+        return self.status
+
+    def run_stage(self, stage) -> str:
+        logger.info(f"{self.name}: Running stage {stage.name}")
+        try:
+            with session_lock if stage.exclusive else nullcontext():
+                result = stage.func(self.results)
+            self.results[stage.name] = result
+            self.wasp.checkpoint(stage.name, str(result) if isinstance(result, Path) else result)
+        except subprocess.TimeoutExpired as exc:
+            self.wasp.throw(f"{stage.name} timed out: {exc}\n")
+            self.failures.append(exc)
+            return FAILED
+        except Exception as exc:
+            logger.exception(f"{self.name}: Stage {stage.name} failed")
+            self.wasp.throw(f"{stage.name} failed: {type(exc)} : {exc}\n")
+            self.failures.append(exc)
+            return FAILED
+        logger.info(f"{self.name}: Done with stage {stage.name}")
+        return DONE
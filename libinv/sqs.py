@@ -1,39 +1,174 @@
+import json
+from functools import cached_property
+from functools import lru_cache
+
 import boto3
 
 from libinv.env import AWS_REGION
 from libinv.env import SQS_QUEUE_NAME
 
+SQS_BATCH_SIZE = 10  # sqs allows at most 10 entries per batch call
+MAX_DELAY = 900  # seconds, sqs can't delay a message for longer
+# Bodies of messages the sharder puts back carry their count of requeues under this key, see
+# Sharder.split
+REQUEUE_FIELD = "libinv_requeue"
+
+
+def receive_count(message: dict) -> int:
+    """
+    Return how many times a message was delivered, including this time
+    """
+    return int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+
+
+def requeue_info(message: dict) -> dict:
+    """
+    Return what a message put back by the sharder carries about the copies sent before it: how
+    many times they were put back and received, and the id of the first one
+
+    >>> requeue_info({"MessageId": "b", "Body": requeued_body({"MessageId": "a", "Body": "{}"})})
+    {'requeues': 1, 'receives': 1, 'message_id': 'a'}
+    >>> requeue_info({"MessageId": "a", "Body": "not json"})
+    {'requeues': 0, 'receives': 0, 'message_id': 'a'}
+    """
+    info = {"requeues": 0, "receives": 0, "message_id": message.get("MessageId")}
+    try:
+        body = json.loads(message["Body"])
+    except (json.JSONDecodeError, TypeError, KeyError):
+        return info
+    if isinstance(body, dict) and isinstance(body.get(REQUEUE_FIELD), dict):
+        info.update(body[REQUEUE_FIELD])
+    return info
+
+
+def requeued_body(message: dict) -> str:
+    """
+    Return the body of a copy of a message to be sent in its place, counting it as put back once
+    more. Only messages with a json object as body can be put back.
+    """
+    body = json.loads(message["Body"])
+    info = requeue_info(message)
+    body[REQUEUE_FIELD] = {
+        "requeues": info["requeues"] + 1,
+        "receives": info["receives"] + receive_count(message),
+        "message_id": info["message_id"],
+    }
+    return json.dumps(body)
+
+
+def attempt_count(message: dict) -> int:
+    """
+    Return how many times a message was delivered to be processed, including this time: its
+    deliveries and those of copies sent before it, less the ones that only put it back
+
+    >>> first = {"MessageId": "a", "Body": "{}", "Attributes": {"ApproximateReceiveCount": "2"}}
+    >>> attempt_count(first)
+    2
+    >>> attempt_count({"MessageId": "b", "Body": requeued_body(first)})
+    2
+    """
+    info = requeue_info(message)
+    return max(info["receives"] + receive_count(message) - info["requeues"], 1)
+
+
+class SqsConsumer:
+    """
+    Consume an sqs queue through a single client.
+    The client (and with it, its pool of HTTP connections) and the queue url are built once and
+    reused for every call.
+    """
+
+    def __init__(self, queue_name=SQS_QUEUE_NAME, region_name=AWS_REGION):
+        self.queue_name = queue_name
+        self.region_name = region_name
+
+    @cached_property
+    def client(self):
+        return boto3.client("sqs", region_name=self.region_name)
+
+    @cached_property
+    def queue_url(self):
+        response = self.client.get_queue_url(QueueName=self.queue_name)
+        return response["QueueUrl"]
+
+    def receive(self, count=1, wait_time=20):
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=count,
+            WaitTimeSeconds=wait_time,
+            AttributeNames=["ApproximateReceiveCount"],
+        )
+        return response.get("Messages", [])
+
+    def poll(self, count=SQS_BATCH_SIZE):
+        messages = []
+        while not messages:
+            messages = self.receive(count=count)
+        return messages
+
+    def send(self, body: str, delay=0) -> str:
+        response = self.client.send_message(
+            QueueUrl=self.queue_url, MessageBody=body, DelaySeconds=min(delay, MAX_DELAY)
+        )
+        return response["MessageId"]
+
+    def delete(self, receipt_handles: list):
+        """
+        Delete messages with given receipt handles, one api call per 10 messages.
+        Return entries that could not be deleted.
+        """
+        return self._batch(
+            self.client.delete_message_batch,
+            [{"ReceiptHandle": handle} for handle in receipt_handles],
+        )
+
+    def change_visibility(self, receipt_handles: list, timeout: int):
+        """
+        Hide messages with given receipt handles from other consumers for another ``timeout``
+        seconds. Return entries that could not be changed.
+        """
+        return self._batch(
+            self.client.change_message_visibility_batch,
+            [{"ReceiptHandle": handle, "VisibilityTimeout": timeout} for handle in receipt_handles],
+        )
+
+    def _batch(self, api, entries: list):
+        failed = []
+        for start in range(0, len(entries), SQS_BATCH_SIZE):
+            chunk = [
+                {"Id": str(i), **entry}
+                for i, entry in enumerate(entries[start : start + SQS_BATCH_SIZE])
+            ]
+            response = api(QueueUrl=self.queue_url, Entries=chunk)
+            failed.extend(response.get("Failed", []))
+        return failed
+
+
+@lru_cache(maxsize=None)
+def get_consumer() -> SqsConsumer:
+    return SqsConsumer()
+
 
 def get_queue_url():
-    sqs_client = boto3.client("sqs", region_name=AWS_REGION)
-    response = sqs_client.get_queue_url(
-        QueueName=SQS_QUEUE_NAME,
-    )
-    return response["QueueUrl"]
+    return get_consumer().queue_url
 
 
-def receive_messages(queue_url: str, count=1):
-    sqs_client = boto3.client("sqs", region_name=AWS_REGION)
-    response = sqs_client.receive_message(
-        QueueUrl=queue_url,
-        MaxNumberOfMessages=count,
-        WaitTimeSeconds=20,
-    )
-    messages = response.get("Messages", [])
-    return messages
+def receive_messages(queue_url: str, count=1, wait_time=20):
+    return get_consumer().receive(count=count, wait_time=wait_time)
 
 
 def delete_message(receipt_handle):
-    sqs_client = boto3.client("sqs", region_name=AWS_REGION)
-    response = sqs_client.delete_message(
-        QueueUrl=get_queue_url(),
+    consumer = get_consumer()
+    response = consumer.client.delete_message(
+        QueueUrl=consumer.queue_url,
         ReceiptHandle=receipt_handle,
     )
     return response
 
 
+def change_message_visibility(receipt_handles: list, timeout: int):
+    return get_consumer().change_visibility(receipt_handles, timeout)
+
+
 def poll():
-    messages = []
-    while not messages:
-        messages = receive_messages(get_queue_url(), count=10)
-    return messages
+    return get_consumer().poll()